@@ -0,0 +1,32 @@
+"""add_sizes_available_index
+
+Revision ID: 3c9d0f6b81ae
+Revises: 75a82a92db64
+Create Date: 2026-10-18 14:22:07.530118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9d0f6b81ae'
+down_revision: Union[str, None] = '75a82a92db64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so the sizes table stays writable while the index is created.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_sizes_clothing_id_available', 'sizes', ['clothing_id'],
+                        unique=False, postgresql_where=sa.text('quantity > 0'),
+                        postgresql_include=['size', 'quantity'], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_sizes_clothing_id_available', table_name='sizes',
+                      postgresql_concurrently=True)
@@ -0,0 +1,38 @@
+"""add_idempotency_keys
+
+Revision ID: 5e8a1f0c2d47
+Revises: b47e2a1c90d3
+Create Date: 2026-10-18 18:12:05.431907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8a1f0c2d47'
+down_revision: Union[str, None] = 'b47e2a1c90d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.LargeBinary(length=16), nullable=False),
+        sa.Column('fingerprint', sa.LargeBinary(length=16), nullable=False),
+        sa.Column('status_code', sa.SmallInteger(), nullable=False),
+        sa.Column('body', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_idempotency_keys_created_at'), 'idempotency_keys', ['created_at'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_idempotency_keys_created_at'), table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,27 @@
+"""add_token_version
+
+Revision ID: 75a82a92db64
+Revises: e54cf43cd14c
+Create Date: 2026-10-18 12:04:31.412094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '75a82a92db64'
+down_revision: Union[str, None] = 'e54cf43cd14c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0',
+                                     nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,116 @@
+"""orders_user_and_size_foreign_keys
+
+Revision ID: 9d4c7b2e6a15
+Revises: 5e8a1f0c2d47
+Create Date: 2026-10-18 19:03:44.718256
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4c7b2e6a15'
+down_revision: Union[str, None] = '5e8a1f0c2d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+
+def backfill(statement: str):
+    """
+    Run `statement` for orders ids in (:start, :end] batches, each batch commits on its own
+    so rows are not locked for the whole backfill.
+    """
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        last_id = connection.execute(sa.text('SELECT coalesce(max(id), 0) FROM orders')).scalar()
+        for start in range(0, last_id, BATCH_SIZE):
+            connection.execute(sa.text(statement), {'start': start, 'end': start + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.add_column('orders', sa.Column('size_id', sa.Integer(), nullable=True))
+    backfill("""
+        UPDATE orders SET user_id = users.id, size_id = sizes.id
+        FROM users, clothing, sizes
+        WHERE orders.id > :start AND orders.id <= :end
+            AND users.email = orders.email_user
+            AND clothing.name = orders.name_clothing
+            AND sizes.clothing_id = clothing.id AND sizes.size = orders.size
+    """)
+    # Orders of deleted users or clothing have nothing to reference and keep NULLs, as
+    # orders do when their user or clothing is deleted later. Their strings are kept in
+    # orders_unresolved for the downgrade.
+    op.execute("""
+        CREATE TABLE orders_unresolved AS
+        SELECT id, name_user, birthdate, email_user, name_clothing, size FROM orders
+        WHERE user_id IS NULL OR size_id IS NULL
+    """)
+    unresolved = op.get_bind().execute(sa.text('SELECT count(*) FROM orders_unresolved')).scalar()
+    if unresolved:
+        logger.warning('%s orders of deleted users or clothing kept without references, '
+                       'their strings are in orders_unresolved', unresolved)
+    op.create_foreign_key('orders_user_id_fkey', 'orders', 'users', ['user_id'], ['id'],
+                          ondelete='SET NULL')
+    op.create_foreign_key('orders_size_id_fkey', 'orders', 'sizes', ['size_id'], ['id'],
+                          ondelete='SET NULL')
+    op.create_index('ix_orders_user_id_size_id', 'orders', ['user_id', 'size_id'], unique=False)
+    op.create_index(op.f('ix_orders_size_id'), 'orders', ['size_id'], unique=False)
+    op.drop_index('ix_orders_name_clothing', table_name='orders')
+    op.drop_index('ix_orders_email_user', table_name='orders')
+    op.drop_column('orders', 'size')
+    op.drop_column('orders', 'name_clothing')
+    op.drop_column('orders', 'email_user')
+    op.drop_column('orders', 'birthdate')
+    op.drop_column('orders', 'name_user')
+
+
+def downgrade() -> None:
+    op.add_column('orders', sa.Column('name_user', sa.String(), nullable=True))
+    op.add_column('orders', sa.Column('birthdate', sa.Date(), nullable=True))
+    op.add_column('orders', sa.Column('email_user', sa.String(), nullable=True))
+    op.add_column('orders', sa.Column('name_clothing', sa.String(), nullable=True))
+    op.add_column('orders', sa.Column('size', sa.String(), nullable=True))
+    backfill("""
+        UPDATE orders SET name_user = users.name, birthdate = users.birthdate,
+            email_user = users.email
+        FROM users
+        WHERE orders.id > :start AND orders.id <= :end AND users.id = orders.user_id
+    """)
+    backfill("""
+        UPDATE orders SET name_clothing = clothing.name, size = sizes.size
+        FROM clothing, sizes
+        WHERE orders.id > :start AND orders.id <= :end
+            AND sizes.id = orders.size_id AND clothing.id = sizes.clothing_id
+    """)
+    op.execute("""
+        UPDATE orders SET name_user = unresolved.name_user, birthdate = unresolved.birthdate,
+            email_user = unresolved.email_user, name_clothing = unresolved.name_clothing,
+            size = unresolved.size
+        FROM orders_unresolved unresolved WHERE unresolved.id = orders.id
+    """)
+    op.drop_table('orders_unresolved')
+    # The old columns can not hold orders whose user or clothing was deleted since.
+    deleted = op.get_bind().execute(sa.text("""
+        DELETE FROM orders WHERE name_user IS NULL OR name_clothing IS NULL
+    """)).rowcount
+    if deleted:
+        logger.warning('Deleted %s orders of deleted users or clothing', deleted)
+    for column in ('name_user', 'birthdate', 'email_user', 'name_clothing', 'size'):
+        op.alter_column('orders', column, nullable=False)
+    op.create_index('ix_orders_email_user', 'orders', ['email_user'], unique=False)
+    op.create_index('ix_orders_name_clothing', 'orders', ['name_clothing'], unique=False)
+    op.drop_index(op.f('ix_orders_size_id'), table_name='orders')
+    op.drop_index('ix_orders_user_id_size_id', table_name='orders')
+    op.drop_constraint('orders_size_id_fkey', 'orders', type_='foreignkey')
+    op.drop_constraint('orders_user_id_fkey', 'orders', type_='foreignkey')
+    op.drop_column('orders', 'size_id')
+    op.drop_column('orders', 'user_id')
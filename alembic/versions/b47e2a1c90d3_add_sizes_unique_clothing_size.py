@@ -0,0 +1,40 @@
+"""add_sizes_unique_clothing_size
+
+Revision ID: b47e2a1c90d3
+Revises: 3c9d0f6b81ae
+Create Date: 2026-10-18 15:41:52.208733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b47e2a1c90d3'
+down_revision: Union[str, None] = '3c9d0f6b81ae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Merge duplicated sizes into the oldest row before the constraint is added.
+    op.execute("""
+        WITH duplicates AS (
+            SELECT id, first_value(id) OVER w AS keep_id, sum(quantity) OVER w AS total
+            FROM sizes
+            WINDOW w AS (PARTITION BY clothing_id, size ORDER BY id
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+        ), merged AS (
+            UPDATE sizes SET quantity = duplicates.total
+            FROM duplicates
+            WHERE sizes.id = duplicates.id AND duplicates.id = duplicates.keep_id
+        )
+        DELETE FROM sizes USING duplicates
+        WHERE sizes.id = duplicates.id AND duplicates.id <> duplicates.keep_id
+    """)
+    op.create_unique_constraint('uq_sizes_clothing_id_size', 'sizes', ['clothing_id', 'size'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_sizes_clothing_id_size', 'sizes', type_='unique')
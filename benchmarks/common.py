@@ -0,0 +1,65 @@
+"""
+Shared setup for the benchmarks.
+
+Benchmarks run the application in-process through httpx ASGITransport against the
+test database from src/config.py. The schema is created on start and dropped on exit,
+the same way tests/conftest.py does it, so never point the test settings at real data.
+"""
+from contextlib import asynccontextmanager
+
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from src.config import settings
+from src.database import Base, async_session, async_session_read, instrument_engine
+from src.main import app
+
+engine_bench = create_async_engine(
+    settings.async_database_url_test, pool_size=20, max_overflow=0
+)
+async_session_bench = async_sessionmaker(engine_bench, class_=AsyncSession,
+                                         expire_on_commit=False)
+
+# Rebinding the application's session factories instead of overriding the dependencies
+# keeps FastAPI from analysing the override functions again on every request.
+async_session.configure(bind=engine_bench)
+async_session_read.configure(bind=engine_bench)
+instrument_engine(engine_bench, 'bench')
+
+
+@asynccontextmanager
+async def prepared_database():
+    async with engine_bench.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        yield
+    finally:
+        async with engine_bench.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+        await engine_bench.dispose()
+
+
+def bench_client() -> AsyncClient:
+    return AsyncClient(base_url='http://bench', transport=ASGITransport(app=app))
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies: list[float]) -> dict:
+    """
+    Latencies in seconds to a dict of percentiles in milliseconds.
+    """
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
@@ -0,0 +1,125 @@
+"""
+Serialization of a 10k row list response, FastAPI `response_model` against `RowSerializer`.
+
+First serializes 10k detached users in-process, then requests the 10k orders of one user
+through GET /admin/orders/{email}/ with FAST_JSON_RESPONSES off and on.
+
+    python -m benchmarks.json_responses --rows 10000
+"""
+import argparse
+import asyncio
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from pydantic import TypeAdapter
+from sqlalchemy import text
+
+from benchmarks.common import prepared_database, async_session_bench, bench_client, \
+    latency_summary
+from src.admin.schemas import UserResponse, user_list_serializer
+from src.auth.auth import create_access_token, user_claims
+from src.auth.models import User
+from src.clothing.models import Clothing, Size
+from src.config import settings
+
+
+async def best_of(repeat: int, serialize) -> tuple[float, bytes]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = await serialize()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000, body
+
+
+async def serializers(rows: int, repeat: int):
+    users = [
+        User(id=number, name='Bench', surname='Bench', birthdate=date(2000, 1, 1),
+             email=f'u{number}@mail.ru', hashed_password='x')
+        for number in range(rows)
+    ]
+    field = create_model_field(name='Response', type_=list[UserResponse], mode='serialization')
+    adapter = TypeAdapter(list[UserResponse])
+
+    async def response_model(response_class):
+        content = await serialize_response(
+            field=field, response_content=users, is_coroutine=True
+        )
+        return response_class(content).body
+
+    async def type_adapter():
+        return adapter.dump_json(adapter.validate_python(users, from_attributes=True))
+
+    async def row_serializer():
+        return user_list_serializer.dumps(users)
+
+    results = {
+        'response_model + json': await best_of(repeat, lambda: response_model(JSONResponse)),
+        'response_model + orjson': await best_of(
+            repeat, lambda: response_model(ORJSONResponse)
+        ),
+        'TypeAdapter.dump_json': await best_of(repeat, type_adapter),
+        'RowSerializer': await best_of(repeat, row_serializer),
+    }
+    bodies = {body for _, body in results.values()}
+    print(f'{rows} users, best of {repeat}, identical output: {len(bodies) == 1}')
+    for name, (milliseconds, _) in results.items():
+        print(f'  {name:<26} {milliseconds:>9.1f} ms')
+
+
+async def endpoint(rows: int, requests: int):
+    async with prepared_database():
+        async with async_session_bench() as session:
+            admin = User(
+                name='Admin', surname='Admin', birthdate=date(2000, 1, 1),
+                email='admin@mail.ru', hashed_password='x', is_admin=True, is_user=False
+            )
+            bench = User(
+                name='Bench', surname='Bench', birthdate=date(2000, 1, 1),
+                email='bench@mail.ru', hashed_password='x'
+            )
+            shirt = Clothing(name='Shirt')
+            session.add_all([admin, bench, shirt])
+            await session.flush()
+            size = Size(clothing_id=shirt.id, size='M', quantity=rows)
+            session.add(size)
+            await session.flush()
+            await session.execute(text(
+                'INSERT INTO orders (user_id, size_id) '
+                'SELECT :user_id, :size_id FROM generate_series(1, :rows)'
+            ), {'user_id': bench.id, 'size_id': size.id, 'rows': rows})
+            await session.commit()
+            token = create_access_token(user_claims(admin), timedelta(minutes=30))
+        headers = {'Authorization': f'Bearer {token}'}
+        print(f'GET /admin/orders/{{email}}/ with {rows} orders, {requests} requests')
+        async with bench_client() as client:
+            for fast in (False, True):
+                latencies = []
+                with patch.object(settings, 'FAST_JSON_RESPONSES', fast):
+                    for _ in range(requests):
+                        start = time.perf_counter()
+                        response = await client.get('/admin/orders/bench@mail.ru/',
+                                                    headers=headers)
+                        latencies.append(time.perf_counter() - start)
+                        assert response.status_code == 200, response.text
+                summary = latency_summary(latencies)
+                print(f'  FAST_JSON_RESPONSES={str(fast):<5}  p50 {summary["p50_ms"]:>8} ms  '
+                      f'p95 {summary["p95_ms"]:>8} ms')
+
+
+async def main(rows: int, repeat: int, requests: int):
+    await serializers(rows, repeat)
+    await endpoint(rows, requests)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat, args.requests))
@@ -0,0 +1,77 @@
+"""
+Cost of logging one request on the request path.
+
+Compares the former synchronous FileHandler with an f-string message against the queue
+logger with JSON lines, at full and at 10% sampling of successful requests. Only the time
+spent in the calling thread is measured, writing to the file happens in the listener.
+
+    python -m benchmarks.logging_overhead --calls 100000
+"""
+import argparse
+import atexit
+import logging
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import percentile
+from src.config import settings
+from src.logger_queue import queue_logger
+
+
+def file_logger(path: str) -> logging.Logger:
+    logger = logging.getLogger('bench.file')
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(path, encoding='utf-8', mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
+
+
+def measure(log_request, calls: int) -> list[float]:
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        log_request()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(calls: int):
+    with tempfile.TemporaryDirectory() as directory:
+        settings.LOG_DIR = directory
+        old = file_logger(os.path.join(directory, 'old.log'))
+        new = queue_logger('bench.queue', 'new.log', logging.INFO)
+        new.propagate = False
+        fields = {'method': 'GET', 'path': '/clothing/', 'query': '', 'status': 200,
+                  'ip': '127.0.0.1', 'duration_ms': 1.234}
+
+        def old_style():
+            old.info(f'Request from /clothing/: GET - http://test/clothing/ ip - 127.0.0.1')
+
+        def queue_style():
+            new.info('Request', extra={'fields': fields})
+
+        def queue_sampled():
+            if random.random() < 0.1:
+                new.info('Request', extra={'fields': fields})
+
+        print(f'{"mode":<22} {"p50 us":>8} {"p99 us":>8} {"max us":>9}')
+        for mode, log_request in (('file handler', old_style), ('queue + json', queue_style),
+                                  ('queue + json, 10%', queue_sampled)):
+            timings = [timing * 1e6 for timing in measure(log_request, calls)]
+            print(f'{mode:<22} {percentile(timings, 50):>8.1f} {percentile(timings, 99):>8.1f} '
+                  f'{max(timings):>9.1f}')
+        for handler in new.handlers:
+            atexit.unregister(handler.listener.stop)
+            handler.listener.stop()
+        logging.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args()
+    main(args.calls)
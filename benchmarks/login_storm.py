@@ -0,0 +1,85 @@
+"""
+Latency of GET /clothing/ while other clients hammer POST /auth/token/.
+
+Runs the same storm twice: once with bcrypt called directly on the event loop, the way
+it was done before the hashing executor, and once through `password_hasher`.
+
+    python -m benchmarks.login_storm --seconds 10 --logins 16
+"""
+import argparse
+import asyncio
+import time
+from datetime import date
+from unittest.mock import patch
+
+from benchmarks.common import prepared_database, async_session_bench, bench_client, \
+    latency_summary
+from src.auth.hashing import password_hasher, pwd_context
+from src.auth.models import User
+from src.clothing.models import Clothing
+
+
+async def seed():
+    async with async_session_bench() as session:
+        session.add(User(
+            name='Storm', surname='Storm', birthdate=date(2000, 1, 1),
+            email='storm@mail.ru', hashed_password=pwd_context.hash('stormpassword')
+        ))
+        session.add_all([Clothing(name=f'Item{chr(97 + i // 26)}{chr(97 + i % 26)}')
+                         for i in range(50)])
+        await session.commit()
+
+
+async def storm(seconds: float, logins: int) -> dict:
+    async with bench_client() as client:
+        response = await client.post(
+            '/auth/token/', data={'username': 'storm@mail.ru', 'password': 'stormpassword'}
+        )
+        headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+        deadline = time.perf_counter() + seconds
+        latencies = []
+        statuses = {}
+
+        async def login():
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    '/auth/token/',
+                    data={'username': 'storm@mail.ru', 'password': 'stormpassword'}
+                )
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def browse():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get('/clothing/', headers=headers)
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(browse(), *(login() for _ in range(logins)))
+    return {'clothing': latency_summary(latencies), 'logins': statuses}
+
+
+async def main(seconds: float, logins: int):
+    async def blocking_run(func, *args):
+        return func(*args)
+
+    async with prepared_database():
+        await seed()
+        with patch.object(password_hasher, '_run', blocking_run):
+            blocking = await storm(seconds, logins)
+        executor = await storm(seconds, logins)
+        quiet = await storm(seconds, 0)
+    print(f'{"mode":<10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"reads":>7}  logins')
+    for mode, result in (('quiet', quiet), ('blocking', blocking), ('executor', executor)):
+        clothing = result['clothing']
+        print(f'{mode:<10} {clothing["p50_ms"]:>8} {clothing["p95_ms"]:>8} '
+              f'{clothing["p99_ms"]:>8} {clothing["count"]:>7}  {result["logins"]}')
+    password_hasher.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--logins', type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.logins))
@@ -0,0 +1,111 @@
+"""
+Throughput of GET /clothing/ with the access log as BaseHTTPMiddleware and as pure ASGI.
+
+The BaseHTTPMiddleware variant is the `dispatch` function that src/main.py used before
+`AccessLogMiddleware`. Both log every request, the catalog cache keeps the database out
+of the way after the first request.
+
+    python -m benchmarks.middleware_overhead --seconds 5 --clients 16
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date
+
+from fastapi import Request
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from benchmarks.common import prepared_database, async_session_bench, bench_client, \
+    latency_summary
+from src.auth.hashing import pwd_context
+from src.auth.models import User
+from src.clothing.models import Clothing, Size
+from src.config import settings
+from src.logger_request import logger_request
+from src.main import app
+from src.middleware import AccessLogMiddleware
+
+
+async def dispatch(request: Request, call_next):
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        logger_request.error('Middleware error', extra={'fields': {
+            'method': request.method, 'path': request.url.path, 'error': repr(e)
+        }})
+        raise
+    if response.status_code >= 400 or random.random() < settings.LOG_REQUEST_SAMPLE_RATE:
+        logger_request.info('Request', extra={'fields': {
+            'method': request.method,
+            'path': request.url.path,
+            'query': request.url.query,
+            'status': response.status_code,
+            'ip': request.client.host if request.client else None,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+        }})
+    return response
+
+
+MIDDLEWARE = {
+    'none': [],
+    'base http': [Middleware(BaseHTTPMiddleware, dispatch=dispatch)],
+    'pure asgi': [Middleware(AccessLogMiddleware)],
+}
+
+
+async def seed():
+    async with async_session_bench() as session:
+        session.add(User(
+            name='Bench', surname='Bench', birthdate=date(2000, 1, 1),
+            email='bench@mail.ru', hashed_password=pwd_context.hash('benchpassword')
+        ))
+        for i in range(50):
+            clothing = Clothing(name=f'Item{i:02}')
+            clothing.sizes.append(Size(size='M', quantity=10))
+            session.add(clothing)
+        await session.commit()
+
+
+async def drive(seconds: float, clients: int) -> dict:
+    async with bench_client() as client:
+        response = await client.post(
+            '/auth/token/', data={'username': 'bench@mail.ru', 'password': 'benchpassword'}
+        )
+        headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+        await client.get('/clothing/', headers=headers)
+        deadline = time.perf_counter() + seconds
+        latencies = []
+
+        async def browse():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get('/clothing/', headers=headers)
+                assert response.status_code == 200, response.text
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(browse() for _ in range(clients)))
+    return {'rps': round(len(latencies) / seconds), **latency_summary(latencies)}
+
+
+async def main(seconds: float, clients: int):
+    async with prepared_database():
+        await seed()
+        results = {}
+        for mode, middleware in MIDDLEWARE.items():
+            app.user_middleware = list(middleware)
+            app.middleware_stack = None
+            results[mode] = await drive(seconds, clients)
+    print(f'{"mode":<10} {"rps":>7} {"p50 ms":>8} {"p99 ms":>8}')
+    for mode, result in results.items():
+        print(f'{mode:<10} {result["rps"]:>7} {result["p50_ms"]:>8} {result["p99_ms"]:>8}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--clients', type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.clients))
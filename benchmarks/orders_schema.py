@@ -0,0 +1,156 @@
+"""
+Size and lookup latency of orders with copied strings against user_id/size_id foreign keys.
+
+Seeds 1M orders in the current layout and copies them into `orders_wide`, the layout
+before the foreign keys, with its btree indexes on email_user and name_clothing. Then
+compares table and index sizes and the latency of the two lookups by user, the orders of
+a user (`get_orders_user`) and the order of a user for one clothing (`get_order`).
+
+    python -m benchmarks.orders_schema --orders 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import text, table, column, select, Integer, String, Date
+
+from benchmarks.common import prepared_database, async_session_bench, latency_summary
+from src.admin.dependencies import get_orders_user
+from src.order.dependencies import get_order
+
+SIZES = ['XXS', 'XS', 'S', 'M', 'L', 'XL', 'XXL', 'XXXL']
+
+# The layout before the foreign keys, queried through SQLAlchemy like the current one.
+orders_wide = table(
+    'orders_wide', column('id', Integer), column('name_user', String),
+    column('birthdate', Date), column('email_user', String),
+    column('name_clothing', String), column('size', String)
+)
+
+
+async def seed(orders: int, users: int, clothing: int):
+    async with async_session_bench() as session:
+        await session.execute(text(
+            "INSERT INTO clothing (name) SELECT 'Item' || n FROM generate_series(1, :clothing) n"
+        ), {'clothing': clothing})
+        await session.execute(text(
+            'INSERT INTO sizes (clothing_id, size, quantity) '
+            'SELECT clothing.id, size, 1000 FROM clothing '
+            'CROSS JOIN unnest(CAST(:sizes AS varchar[])) size'
+        ), {'sizes': SIZES})
+        await session.execute(text(
+            'INSERT INTO users (name, surname, birthdate, email, hashed_password, '
+            'is_active, is_admin, is_user, token_version) '
+            "SELECT 'Bench' || n, 'Bench', date '2000-01-01', 'u' || n || '@mail.ru', 'x', "
+            'true, false, true, 0 FROM generate_series(1, :users) n'
+        ), {'users': users})
+        # Order n goes to user n % users, clothing and size spread with coprime strides.
+        await session.execute(text(
+            'INSERT INTO orders (user_id, size_id) '
+            'SELECT (SELECT min(id) FROM users) + n % :users, '
+            '(SELECT min(id) FROM sizes) + (CAST(n AS bigint) * 7919) % (:clothing * 8) '
+            'FROM generate_series(0, :orders - 1) n'
+        ), {'users': users, 'clothing': clothing, 'orders': orders})
+        await session.execute(text(
+            'CREATE TABLE orders_wide (id serial PRIMARY KEY, name_user varchar NOT NULL, '
+            'birthdate date NOT NULL, email_user varchar NOT NULL, '
+            'name_clothing varchar NOT NULL, size varchar NOT NULL)'
+        ))
+        await session.execute(text(
+            'INSERT INTO orders_wide (name_user, birthdate, email_user, name_clothing, size) '
+            'SELECT users.name, users.birthdate, users.email, clothing.name, sizes.size '
+            'FROM orders JOIN users ON users.id = orders.user_id '
+            'JOIN sizes ON sizes.id = orders.size_id '
+            'JOIN clothing ON clothing.id = sizes.clothing_id ORDER BY orders.id'
+        ))
+        await session.execute(text(
+            'CREATE INDEX ix_orders_wide_email_user ON orders_wide (email_user)'
+        ))
+        await session.execute(text(
+            'CREATE INDEX ix_orders_wide_name_clothing ON orders_wide (name_clothing)'
+        ))
+        await session.execute(text('ANALYZE'))
+        await session.commit()
+
+
+async def sizes() -> dict[str, tuple[float, float]]:
+    async with async_session_bench() as session:
+        result = await session.execute(text(
+            'SELECT relname, pg_table_size(oid), pg_indexes_size(oid) FROM pg_class '
+            "WHERE relname IN ('orders_wide', 'orders')"
+        ))
+        return {row[0]: (row[1] / 2 ** 20, row[2] / 2 ** 20) for row in result}
+
+
+async def timed(lookup, arguments: list[dict]) -> dict:
+    latencies = []
+    async with async_session_bench() as session:
+        for argument in arguments:
+            start = time.perf_counter()
+            await lookup(session, **argument)
+            latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+async def wide_listing(session, email: str, name: str):
+    c = orders_wide.c
+    orders = select(
+        c.name_user, c.birthdate, c.email_user, c.name_clothing, c.size
+    ).filter(c.email_user == email)
+    return (await session.execute(orders)).all()
+
+
+async def wide_order(session, email: str, name: str):
+    c = orders_wide.c
+    order = select(orders_wide).filter(c.email_user == email, c.name_clothing == name)
+    return (await session.execute(order)).first()
+
+
+async def listing(session, email: str, name: str):
+    return await get_orders_user(session, email)
+
+
+async def order(session, email: str, name: str):
+    return await get_order(session, email, name)
+
+
+async def main(orders: int, users: int, clothing: int, lookups: int):
+    async with prepared_database():
+        try:
+            await seed(orders, users, clothing)
+            print(f'{orders} orders of {users} users, {clothing} clothing items')
+            print(f'  {"table":<12} {"table MiB":>10} {"indexes MiB":>12} {"total MiB":>10}')
+            for name, (table, indexes) in sorted((await sizes()).items(), reverse=True):
+                print(f'  {name:<12} {table:>10.1f} {indexes:>12.1f} {table + indexes:>10.1f}')
+
+            sample = random.Random(0).sample(range(1, users + 1), lookups)
+            arguments = [
+                {'email': f'u{n}@mail.ru', 'name': f'Item{n % clothing + 1}'} for n in sample
+            ]
+            # Warm the caches of both tables before measuring.
+            await timed(wide_listing, arguments)
+            await timed(listing, arguments)
+            print(f'  {"lookup, " + str(lookups) + " users":<40} {"p50 ms":>8} {"p95 ms":>8}')
+            for name, lookup in (
+                    ('orders of a user, copied strings', wide_listing),
+                    ('orders of a user, foreign keys', listing),
+                    ('order of a clothing, copied strings', wide_order),
+                    ('order of a clothing, foreign keys', order),
+            ):
+                summary = await timed(lookup, arguments)
+                print(f'  {name:<40} {summary["p50_ms"]:>8} {summary["p95_ms"]:>8}')
+        finally:
+            async with async_session_bench() as session:
+                await session.execute(text('DROP TABLE IF EXISTS orders_wide'))
+                await session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--clothing', type=int, default=5000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.orders, args.users, args.clothing, args.lookups))
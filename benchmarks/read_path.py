@@ -0,0 +1,100 @@
+"""
+Memory and latency of 100k row listings, ORM entities against column rows.
+
+Loads 100k users and the 100k orders of one user the way `get_users` and
+`get_orders_user` did before, as `User` and `Order` entities, and the way they do now,
+as rows of the needed columns. Since orders reference users and sizes, the `Order`
+entities hold only ids and the column rows are joined. Memory is the tracemalloc peak of
+a separate load.
+
+    python -m benchmarks.read_path --rows 100000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from datetime import date
+
+from sqlalchemy import select, text
+
+from benchmarks.common import prepared_database, async_session_bench
+from src.admin.dependencies import get_users, get_orders_user
+from src.auth.models import User
+from src.order.models import Order
+
+
+async def seed(rows: int):
+    async with async_session_bench() as session:
+        await session.execute(text(
+            'INSERT INTO users (name, surname, birthdate, email, hashed_password, '
+            'is_active, is_admin, is_user, token_version) '
+            "SELECT 'Bench', 'Bench', :birthdate, 'u' || n || '@mail.ru', "
+            "'$2b$12$' || repeat('x', 53), true, false, true, 0 "
+            'FROM generate_series(1, :rows) n'
+        ), {'birthdate': date(2000, 1, 1), 'rows': rows})
+        await session.execute(text(
+            'INSERT INTO users (name, surname, birthdate, email, hashed_password, '
+            'is_active, is_admin, is_user, token_version) '
+            "VALUES ('Bench', 'Bench', :birthdate, 'bench@mail.ru', 'x', true, false, true, 0)"
+        ), {'birthdate': date(2000, 1, 1)})
+        await session.execute(text("INSERT INTO clothing (name) VALUES ('Shirt')"))
+        await session.execute(text(
+            "INSERT INTO sizes (clothing_id, size, quantity) "
+            "SELECT id, 'M', 1000 FROM clothing WHERE name = 'Shirt'"
+        ))
+        await session.execute(text(
+            'INSERT INTO orders (user_id, size_id) '
+            'SELECT users.id, sizes.id FROM generate_series(1, :rows), users, sizes '
+            "WHERE users.email = 'bench@mail.ru'"
+        ), {'rows': rows})
+        await session.commit()
+
+
+async def entities(session, statement):
+    result = await session.execute(statement)
+    return result.scalars().all()
+
+
+async def measure(load, repeat: int) -> tuple[float, float]:
+    """
+    Best time of `repeat` untraced loads, then the peak memory of one traced load.
+    """
+    timings = []
+    for _ in range(repeat):
+        async with async_session_bench() as session:
+            start = time.perf_counter()
+            await load(session)
+            timings.append(time.perf_counter() - start)
+    async with async_session_bench() as session:
+        tracemalloc.start()
+        rows = await load(session)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del rows
+    return min(timings) * 1000, peak / 2 ** 20
+
+
+async def main(rows: int, repeat: int):
+    async with prepared_database():
+        await seed(rows)
+        cases = {
+            'users, User entities': lambda session: entities(session, select(User)),
+            'users, column rows': lambda session: get_users(session, rows + 1),
+            'orders, Order entities': lambda session: entities(session, select(Order).join(
+                User, User.id == Order.user_id
+            ).filter(User.email == 'bench@mail.ru')),
+            'orders, column rows': lambda session: get_orders_user(session, 'bench@mail.ru'),
+        }
+        print(f'{rows} rows, best of {repeat}')
+        print(f'  {"listing":<24} {"time ms":>9} {"peak MiB":>9}')
+        for name, load in cases.items():
+            milliseconds, mebibytes = await measure(load, repeat)
+            print(f'  {name:<24} {milliseconds:>9.1f} {mebibytes:>9.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat))
@@ -0,0 +1,327 @@
+"""
+End-to-end load test of every route.
+
+Seeds the test database with a catalog of clothing in all eight sizes, users and their
+orders, then drives each scenario with concurrent clients for a fixed time. For every
+scenario it reports RPS, latency percentiles and SQL statements per request, the last
+taken from the `/metrics` endpoint of the application.
+
+Results are written as JSON. Given a baseline from an earlier run, a scenario whose RPS
+dropped, whose p95 grew by more than the tolerance, or that executes more statements per
+request is reported as a regression and the exit status is 1.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json --output new.json
+    python -m benchmarks.suite --scale small --scenarios clothing_list,order_create
+
+By default the application runs in-process through ASGITransport. With --url the
+clients go to a running server instead, which must use the test database and a single
+worker, since metrics are per worker process:
+
+    DB_NAME=$DB_NAME_TEST uvicorn src.main:app --workers 1
+    python -m benchmarks.suite --url http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import re
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from itertools import count
+from typing import Callable, NamedTuple
+
+from httpx import AsyncClient
+from sqlalchemy import select, text
+
+from benchmarks.common import prepared_database, async_session_bench, bench_client, \
+    latency_summary
+from src.auth.auth import create_access_token, user_claims
+from src.auth.hashing import pwd_context
+from src.auth.models import User
+from src.config import settings
+
+SIZES = ['XXS', 'XS', 'S', 'M', 'L', 'XL', 'XXL', 'XXXL']
+PASSWORD = 'benchpassword'
+TOKEN_USERS = 1000
+
+SCALES = {
+    'full': {'clothing': 5000, 'users': 100000, 'orders_per_user': 10},
+    'small': {'clothing': 500, 'users': 10000, 'orders_per_user': 10},
+}
+
+STATEMENTS = re.compile(r'^http_request_db_statements_(sum|count)\{route="([^"]*)"} (\S+)$')
+
+
+def clothing_name(number: int) -> str:
+    """
+    Names must be letters only, so the number is spelled in base 26.
+    """
+    return 'Item' + ''.join(chr(97 + number // 26 ** power % 26) for power in (2, 1, 0))
+
+
+CLOTHING_NAME_SQL = (
+    "'Item' || chr(97 + {n} / 676 % 26) || chr(97 + {n} / 26 % 26) || chr(97 + {n} % 26)"
+)
+
+
+async def seed(clothing: int, users: int, orders_per_user: int):
+    """
+    Bulk insert with generate_series, every user shares one password hash.
+    """
+    async with async_session_bench() as session:
+        await session.execute(text(
+            f'INSERT INTO clothing (name) '
+            f'SELECT {CLOTHING_NAME_SQL.format(n="n")} FROM generate_series(0, :last) n'
+        ), {'last': clothing - 1})
+        await session.execute(text(
+            'INSERT INTO sizes (clothing_id, size, quantity) '
+            'SELECT clothing.id, size, 1000 FROM clothing '
+            'CROSS JOIN unnest(CAST(:sizes AS varchar[])) size'
+        ), {'sizes': SIZES})
+        await session.execute(text(
+            'INSERT INTO users (name, surname, birthdate, email, hashed_password, '
+            'is_active, is_admin, is_user, token_version) '
+            "SELECT 'Bench', 'Bench', :birthdate, 'u' || n || '@mail.ru', :password, "
+            "true, n = 0, n <> 0, 0 FROM generate_series(0, :users) n"
+        ), {'birthdate': date(2000, 1, 1), 'password': pwd_context.hash(PASSWORD),
+            'users': users})
+        await session.execute(text(
+            'INSERT INTO orders (user_id, size_id) '
+            'SELECT users.id, sizes.id '
+            'FROM generate_series(1, :users) u CROSS JOIN generate_series(0, :last) k '
+            "JOIN users ON users.email = 'u' || u || '@mail.ru' "
+            f"JOIN clothing ON clothing.name = "
+            f"{CLOTHING_NAME_SQL.format(n='((u * 7 + k * 131) % :clothing)')} "
+            "JOIN sizes ON sizes.clothing_id = clothing.id AND sizes.size = 'M'"
+        ), {'clothing': clothing, 'users': users, 'last': orders_per_user - 1})
+        await session.execute(text('ANALYZE'))
+        await session.commit()
+
+
+def ordered_item(user: int, order: int, clothing: int) -> str:
+    return clothing_name((user * 7 + order * 131) % clothing)
+
+
+async def tokens() -> tuple[str, list[str]]:
+    expires = timedelta(hours=1)
+    async with async_session_bench() as session:
+        users = (await session.scalars(
+            select(User).where(User.id <= TOKEN_USERS + 1).order_by(User.id)
+        )).all()
+    admin = next(user for user in users if user.is_admin)
+    return create_access_token(user_claims(admin), expires), [
+        create_access_token(user_claims(user), expires) for user in users if not user.is_admin
+    ]
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    route: str
+    request: Callable[[random.Random], tuple[str, dict]]
+    admin: bool = False
+    concurrency: int | None = None
+    expected: tuple[int, ...] = (200,)
+
+
+def scenarios(scale: dict) -> list[Scenario]:
+    clothing, users = scale['clothing'], scale['users']
+    registrations = count()
+    deletions = count(1)
+
+    def item(rng: random.Random) -> str:
+        return clothing_name(rng.randrange(clothing))
+
+    def user(rng: random.Random) -> int:
+        return rng.randint(1, users)
+
+    def delete_order(rng: random.Random) -> tuple[str, dict]:
+        number = next(deletions)
+        return '/admin/orders/', {'params': {
+            'email': f'u{number}@mail.ru', 'name': ordered_item(number, 0, clothing)
+        }}
+
+    def intake(rng: random.Random) -> tuple[str, dict]:
+        return '/admin/clothing/bulk/', {'json': [
+            {'name': item(rng), 'size': rng.choice(SIZES), 'quantity': 5} for _ in range(100)
+        ]}
+
+    return [
+        Scenario('clothing_list', 'GET', '/clothing/',
+                 lambda rng: ('/clothing/', {'params': {'limit': 100}})),
+        Scenario('clothing_sizes', 'GET', '/clothing/{name}/sizes/',
+                 lambda rng: (f'/clothing/{item(rng)}/sizes/', {})),
+        Scenario('clothing_sizes_many', 'POST', '/clothing/sizes/',
+                 lambda rng: ('/clothing/sizes/', {
+                     'json': {'names': [item(rng) for _ in range(50)]}
+                 })),
+        Scenario('order_create', 'POST', '/orders/',
+                 lambda rng: ('/orders/', {'json': {'name': item(rng), 'size': 'L'}}),
+                 expected=(200, 409)),
+        Scenario('auth_me', 'GET', '/auth/users/me/', lambda rng: ('/auth/users/me/', {})),
+        Scenario('auth_token', 'POST', '/auth/token/',
+                 lambda rng: ('/auth/token/', {'data': {
+                     'username': f'u{user(rng)}@mail.ru', 'password': PASSWORD
+                 }}),
+                 concurrency=4),
+        Scenario('auth_register', 'POST', '/auth/register/',
+                 lambda rng: ('/auth/register/', {'json': {
+                     'name': 'Bench', 'surname': 'Bench', 'birthdate': '2000-01-01',
+                     'email': f'r{next(registrations)}@mail.ru', 'password': PASSWORD
+                 }}),
+                 concurrency=4),
+        Scenario('admin_users', 'GET', '/admin/users/',
+                 lambda rng: ('/admin/users/', {'params': {'limit': 100}}), admin=True),
+        Scenario('admin_orders', 'GET', '/admin/orders/{email}/',
+                 lambda rng: (f'/admin/orders/u{user(rng)}@mail.ru/', {}), admin=True),
+        Scenario('admin_add_size', 'POST', '/admin/clothing/',
+                 lambda rng: ('/admin/clothing/', {'json': {
+                     'name': item(rng), 'size': rng.choice(SIZES), 'quantity': 1
+                 }}),
+                 admin=True),
+        Scenario('admin_bulk_intake', 'POST', '/admin/clothing/bulk/', intake, admin=True,
+                 concurrency=4),
+        Scenario('admin_delete_order', 'DELETE', '/admin/orders/', delete_order, admin=True),
+        Scenario('admin_export_stock', 'GET', '/admin/export/stock/',
+                 lambda rng: ('/admin/export/stock/', {'params': {'format': 'ndjson'}}),
+                 admin=True, concurrency=2),
+        Scenario('admin_pool', 'GET', '/admin/pool/', lambda rng: ('/admin/pool/', {}),
+                 admin=True),
+        Scenario('metrics', 'GET', '/metrics', lambda rng: ('/metrics', {})),
+    ]
+
+
+async def statement_totals(client: AsyncClient) -> dict[str, list[float]]:
+    totals: dict[str, list[float]] = {}
+    response = await client.get('/metrics')
+    if response.status_code != 200:
+        return totals
+    for line in response.text.splitlines():
+        match = STATEMENTS.match(line)
+        if match:
+            kind, route, value = match.groups()
+            totals.setdefault(route, [0.0, 0.0])[kind == 'count'] = float(value)
+    return totals
+
+
+async def run_scenario(client: AsyncClient, scenario: Scenario, headers: list[dict],
+                       seconds: float, concurrency: int) -> dict:
+    before = await statement_totals(client)
+    latencies = []
+    statuses: dict[int, int] = {}
+    deadline = time.perf_counter() + seconds
+
+    async def worker(number: int):
+        rng = random.Random(number)
+        while time.perf_counter() < deadline:
+            url, kwargs = scenario.request(rng)
+            start = time.perf_counter()
+            response = await client.request(
+                scenario.method, url, headers=rng.choice(headers), **kwargs
+            )
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    after = await statement_totals(client)
+    statements, requests = (
+        after.get(scenario.route, [0, 0])[index] - before.get(scenario.route, [0, 0])[index]
+        for index in (0, 1)
+    )
+    return {
+        'method': scenario.method,
+        'route': scenario.route,
+        'concurrency': concurrency,
+        'rps': round(len(latencies) / elapsed, 1),
+        **latency_summary(latencies),
+        'errors': sum(n for status, n in statuses.items() if status not in scenario.expected),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'queries_per_request': round(statements / requests, 2) if requests else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        if result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f'{name}: rps {base["rps"]} -> {result["rps"]}')
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {base["p95_ms"]} ms -> {result["p95_ms"]} ms')
+        if None not in (result['queries_per_request'], base['queries_per_request']) and \
+                result['queries_per_request'] > base['queries_per_request'] + 0.05:
+            regressions.append(f'{name}: queries per request '
+                               f'{base["queries_per_request"]} -> {result["queries_per_request"]}')
+        if result['errors'] and not base['errors']:
+            regressions.append(f'{name}: {result["errors"]} unexpected responses '
+                               f'{result["statuses"]}')
+    return regressions
+
+
+async def main(args) -> int:
+    scale = SCALES[args.scale]
+    selected = scenarios(scale)
+    if args.scenarios:
+        names = set(args.scenarios.split(','))
+        selected = [scenario for scenario in selected if scenario.name in names]
+    async with prepared_database():
+        started = time.perf_counter()
+        await seed(**scale)
+        seed_seconds = round(time.perf_counter() - started, 1)
+        admin_token, user_tokens = await tokens()
+        admin_headers = [{'Authorization': f'Bearer {admin_token}'}]
+        user_headers = [{'Authorization': f'Bearer {token}'} for token in user_tokens]
+        client = AsyncClient(base_url=args.url, timeout=60) if args.url else bench_client()
+        results = {
+            'meta': {
+                'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'target': args.url or 'asgi',
+                'scale': scale,
+                'seed_seconds': seed_seconds,
+                'seconds': args.seconds,
+                'concurrency': args.concurrency,
+                'python': platform.python_version(),
+                'pool_size': settings.DB_POOL_SIZE,
+            },
+            'scenarios': {},
+        }
+        async with client:
+            for scenario in selected:
+                results['scenarios'][scenario.name] = result = await run_scenario(
+                    client, scenario, admin_headers if scenario.admin else user_headers,
+                    args.seconds, scenario.concurrency or args.concurrency
+                )
+                print(f'{scenario.name:<20} {result["rps"]:>8} rps  p50 {result["p50_ms"]:>8} '
+                      f'p95 {result["p95_ms"]:>8} p99 {result["p99_ms"]:>8} ms  '
+                      f'queries {result["queries_per_request"]}  {result["statuses"]}')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', choices=SCALES, default='full')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--scenarios', help='Comma separated scenario names, all by default')
+    parser.add_argument('--url', help='Base URL of a running server instead of in-process')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with the results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative drop of RPS and growth of p95')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -1,5 +1,8 @@
+from typing import AsyncIterator, Sequence
+
 from pydantic import EmailStr
-from sqlalchemy import select, update
+from sqlalchemy import select, update, delete, Row
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.models import User
@@ -7,10 +10,17 @@ from src.clothing.models import Clothing, Size
 from src.order.models import Order
 
 
-async def get_users(db: AsyncSession) -> [User]:
-    user = select(User)
+async def get_users(db: AsyncSession, limit: int, after_id: int | None = None) -> Sequence[Row]:
+    """
+    (id, name, surname, birthdate, email) rows, without loading `User` entities.
+    """
+    user = select(
+        User.id, User.name, User.surname, User.birthdate, User.email
+    ).order_by(User.id).limit(limit)
+    if after_id is not None:
+        user = user.filter(User.id > after_id)
     result = await db.execute(user)
-    return result.scalars().all()
+    return result.all()
 
 
 async def get_clothing(db: AsyncSession, name: str) -> Clothing | None:
@@ -31,9 +41,11 @@ async def get_size(db, size: str, clothing_id: int) -> Size | None:
     return result.scalars().first()
 
 
-async def update_size(db: AsyncSession, clothing_id: int, increment_quantity: int) -> Size | None:
-    add_quantity = update(Size).filter(Size.clothing_id == clothing_id).values(
-        quantity=increment_quantity).returning(Size)
+async def update_size(
+        db: AsyncSession, clothing_id: int, size: str, increment_quantity: int
+) -> Size | None:
+    add_quantity = update(Size).filter(Size.clothing_id == clothing_id, Size.size == size).values(
+        quantity=Size.quantity + increment_quantity).returning(Size)
     result = await db.execute(add_quantity)
     return result.scalars().first()
 
@@ -54,12 +66,79 @@ async def delete_clothing(db: AsyncSession, clothing: Clothing) -> Clothing:
     return clothing
 
 
-async def get_orders_user(db: AsyncSession, email: EmailStr) -> [Order]:
-    orders = select(Order).filter(Order.email_user == email)
+async def get_orders_user(db: AsyncSession, email: EmailStr) -> Sequence[Row]:
+    """
+    (name_user, birthdate, email_user, name_clothing, size) rows of the orders of a user,
+    joined through the (user_id, size_id) index of orders. name_clothing and size are None
+    for orders of a deleted clothing.
+    """
+    orders = select(
+        User.name.label('name_user'), User.birthdate, User.email.label('email_user'),
+        Clothing.name.label('name_clothing'), Size.size
+    ).select_from(User).join(Order, Order.user_id == User.id).outerjoin(
+        Size, Size.id == Order.size_id
+    ).outerjoin(Clothing, Clothing.id == Size.clothing_id).filter(User.email == email)
     result = await db.execute(orders)
-    return result.scalars().all()
+    return result.all()
 
 
-async def order_delete(db: AsyncSession, order: Order):
-    await db.delete(order)
+async def order_delete(db: AsyncSession, order: Row) -> Row:
+    await db.execute(delete(Order).filter(Order.id == order.id))
     return order
+
+
+async def stream_stock(db: AsyncSession, chunk_size: int) -> AsyncIterator[Sequence[Row]]:
+    """
+    (name, size, quantity) rows of the whole stock in chunks, read through a server side
+    cursor so memory use does not depend on the size of the table.
+    """
+    stock = select(Clothing.name, Size.size, Size.quantity).join(
+        Size, Size.clothing_id == Clothing.id
+    ).order_by(Clothing.id, Size.id).execution_options(yield_per=chunk_size)
+    result = await db.stream(stock)
+    async for partition in result.partitions():
+        yield partition
+
+
+async def upsert_stock(
+        db: AsyncSession, lines: list[tuple[str, str, int]], chunk_size: int = 5000
+) -> dict[tuple[str, str], int]:
+    """
+    Add (name, size, quantity) lines to the stock with set based statements.
+
+    Clothing is inserted with ON CONFLICT (name) DO UPDATE, which returns the id of
+    existing clothing too and locks it against a concurrent delete. Quantities are summed per
+    clothing and size and applied with INSERT ... ON CONFLICT (clothing_id, size)
+    DO UPDATE SET quantity = quantity + excluded.quantity. Rows are written in a fixed
+    order so concurrent intakes lock them in the same order. Returns the new quantity of
+    every touched (name, size).
+    """
+    names = sorted({name for name, _, _ in lines})
+    ids = {}
+    for start in range(0, len(names), chunk_size):
+        clothing = insert(Clothing).values(
+            [{'name': name} for name in names[start:start + chunk_size]]
+        )
+        clothing = clothing.on_conflict_do_update(
+            index_elements=['name'], set_={'name': clothing.excluded.name}
+        ).returning(Clothing.id, Clothing.name)
+        ids.update({row.name: row.id for row in await db.execute(clothing)})
+    quantities = {}
+    for name, size, quantity in lines:
+        key = (ids[name], size)
+        quantities[key] = quantities.get(key, 0) + quantity
+    rows = [
+        {'clothing_id': clothing_id, 'size': size, 'quantity': quantity}
+        for (clothing_id, size), quantity in sorted(quantities.items())
+    ]
+    names_by_id = {clothing_id: name for name, clothing_id in ids.items()}
+    totals = {}
+    for start in range(0, len(rows), chunk_size):
+        stock = insert(Size).values(rows[start:start + chunk_size])
+        stock = stock.on_conflict_do_update(
+            index_elements=['clothing_id', 'size'],
+            set_={'quantity': Size.quantity + stock.excluded.quantity}
+        ).returning(Size.clothing_id, Size.size, Size.quantity)
+        for row in await db.execute(stock):
+            totals[(names_by_id[row.clothing_id], row.size)] = row.quantity
+    return totals
@@ -1,18 +1,31 @@
-from typing import Annotated
+import csv
+import io
+from typing import Annotated, Any, Literal, Sequence
 
-from pydantic import EmailStr
+import orjson
+from pydantic import EmailStr, ValidationError
+from sqlalchemy import Row
 from sqlalchemy.exc import IntegrityError
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from src.admin.dependencies import get_clothing, add_clothing, get_size, add_size, \
-    update_size, delete_user, delete_clothing, get_users, get_orders_user, order_delete
-from src.auth.auth import get_current_admin_user
+    update_size, delete_user, delete_clothing, get_users, get_orders_user, order_delete, \
+    stream_stock, upsert_stock
+from src.auth.auth import get_current_admin_user, revoke_user_tokens, forget_user_tokens
 from src.auth.dependencies import get_user_email
 from src.auth.schemas import UserBase
-from src.database import get_async_session
+from src.clothing.cache import catalog_cache
+from src.clothing.events import StockChange, publish_stock_changes
+from src.config import settings
+from src.database import get_async_session, get_async_session_read, \
+    get_async_sessionmaker_read, pool_stats
+from src.idempotency.dependencies import IdempotentRequest, idempotent_request
 from src.logger_error import logger
-from src.admin.schemas import CreateClothing, DeleteClothing, UserResponse, OrdersUser
+from src.pagination import PageParams, page_params, split_page, NEXT_CURSOR_HEADER
+from src.admin.schemas import CreateClothing, DeleteClothing, UserResponse, OrdersUser, \
+    IntakeLine, MAX_INTAKE_LINES, user_list_serializer, order_list_serializer, \
+    intake_lines_adapter
 from src.order.dependencies import get_order
 
 router = APIRouter(
@@ -25,7 +38,8 @@ router = APIRouter(
 @router.post('/clothing/', response_model=CreateClothing)
 async def add_clothing_size(
         db: Annotated[AsyncSession, Depends(get_async_session)],
-        create_clothing: CreateClothing
+        create_clothing: CreateClothing,
+        idempotency: Annotated[IdempotentRequest | None, Depends(idempotent_request)]
 ):
     """
     Add clothing and size.
@@ -34,11 +48,15 @@ async def add_clothing_size(
             name (string): Only letters, characters > 3 and < 20.
             size (string): Size xxs, xs, s, m, l, xl, xxl, xxxl.
             quantity (integer): Quantity clothing more 0.
+            Idempotency-Key (header): Optional, a retry with the same key returns the
+                stored response instead of adding the quantity again.
 
         Returns:
             Clothing, size and quantity.
     """
     try:
+        if idempotency is not None and (replay := await idempotency.replay(db)):
+            return replay
         clothing = await get_clothing(db, create_clothing.name)
         if clothing is None:
             new_clothing = await add_clothing(db, create_clothing.name)
@@ -46,8 +64,7 @@ async def add_clothing_size(
             new_clothing = clothing
         size = await get_size(db, create_clothing.size, new_clothing.id)
         if size is not None:
-            increment_quantity = size.quantity + create_clothing.quantity
-            await update_size(db, size.clothing_id, increment_quantity)
+            size = await update_size(db, size.clothing_id, size.size, create_clothing.quantity)
             message = JSONResponse(content={
                 'status': 'success',
                 'message': f'Added {create_clothing.quantity} units'
@@ -55,16 +72,179 @@ async def add_clothing_size(
                 f'size {create_clothing.size}'
             })
         else:
-            await add_size(db, new_clothing.id, create_clothing.size, create_clothing.quantity)
+            size = await add_size(
+                db, new_clothing.id, create_clothing.size, create_clothing.quantity
+            )
             message = create_clothing
+        await publish_stock_changes(
+            db, [StockChange(create_clothing.name, size.size, size.quantity)]
+        )
+        if idempotency is not None and not await idempotency.save(
+                db, message.body if isinstance(message, JSONResponse)
+                else message.model_dump_json().encode()
+        ):
+            await db.rollback()
+            return await idempotency.replay_concurrent(db)
         await db.commit()
+        catalog_cache.bump()
+        if idempotency is not None:
+            idempotency.remember()
         return message
+    except IntegrityError as error:
+        logger.error(error)
+        if idempotency is not None:
+            # A concurrent request with the same key created the clothing first.
+            await db.rollback()
+            if replay := await idempotency.replay(db):
+                return replay
+        raise HTTPException(
+            status_code=503,
+            detail=f'Database error: {error}'
+        )
+    except HTTPException as error:
+        logger.error(error)
+        raise error
+    except Exception as error:
+        logger.error(error)
+        raise HTTPException(
+            status_code=500,
+            detail=f'Server error: {error}'
+        )
+
+
+async def _apply_intake(
+        db: AsyncSession, raw_lines: list[dict[str, Any]],
+        idempotency: IdempotentRequest | None = None
+) -> list[IntakeLine] | Response:
+    if len(raw_lines) > MAX_INTAKE_LINES:
+        raise HTTPException(
+            status_code=422,
+            detail=f'No more than {MAX_INTAKE_LINES} lines per intake'
+        )
+    results = []
+    lines = []
+    for number, raw_line in enumerate(raw_lines, start=1):
+        try:
+            line = CreateClothing.model_validate(raw_line)
+        except HTTPException as error:
+            results.append(IntakeLine(line=number, status='error', detail=error.detail))
+        except ValidationError as error:
+            results.append(IntakeLine(
+                line=number, status='error',
+                detail='; '.join(f'{".".join(map(str, e["loc"]))}: {e["msg"]}'
+                                 for e in error.errors())
+            ))
+        else:
+            lines.append(line)
+            results.append(IntakeLine(
+                line=number, name=line.name, size=line.size, status='added'
+            ))
+    if lines:
+        totals = await upsert_stock(db, [(line.name, line.size, line.quantity) for line in lines])
+        await publish_stock_changes(
+            db, [StockChange(name, size, quantity) for (name, size), quantity in totals.items()]
+        )
+        for result in results:
+            if result.status == 'added':
+                result.quantity = totals[(result.name, result.size)]
+        if idempotency is not None and not await idempotency.save(
+                db, intake_lines_adapter.dump_json(results)
+        ):
+            await db.rollback()
+            return await idempotency.replay_concurrent(db)
+        await db.commit()
+        catalog_cache.bump()
+        if idempotency is not None:
+            idempotency.remember()
+    return results
+
+
+@router.post('/clothing/bulk/', response_model=list[IntakeLine])
+async def add_clothing_bulk(
+        db: Annotated[AsyncSession, Depends(get_async_session)],
+        lines: Annotated[list[dict[str, Any]], Body()],
+        idempotency: Annotated[IdempotentRequest | None, Depends(idempotent_request)]
+):
+    """
+    Add a delivery of clothing and sizes in one request.
+
+        Params:
+            JSON array of objects with name, size and quantity, the same fields as for
+            adding one clothing.
+            Idempotency-Key (header): Optional, a retry with the same key returns the
+                stored results instead of adding the delivery again.
+
+        Returns:
+            Result for every line, valid lines are added in one transaction and report the
+            new quantity of the size.
+    """
+    try:
+        if idempotency is not None and (replay := await idempotency.replay(db)):
+            return replay
+        return await _apply_intake(db, lines, idempotency)
     except IntegrityError as error:
         logger.error(error)
         raise HTTPException(
             status_code=503,
             detail=f'Database error: {error}'
         )
+    except HTTPException as error:
+        logger.error(error)
+        raise error
+    except Exception as error:
+        logger.error(error)
+        raise HTTPException(
+            status_code=500,
+            detail=f'Server error: {error}'
+        )
+
+
+@router.post('/clothing/bulk/csv/', response_model=list[IntakeLine])
+async def add_clothing_bulk_csv(
+        db: Annotated[AsyncSession, Depends(get_async_session)],
+        file: UploadFile,
+        idempotency: Annotated[IdempotentRequest | None, Depends(idempotent_request)]
+):
+    """
+    Add a delivery of clothing and sizes from a CSV file.
+
+        Params:
+            file (CSV): Header name,size,quantity and one line per clothing and size.
+            Idempotency-Key (header): Optional, a retry with the same key returns the
+                stored results instead of adding the delivery again.
+
+        Returns:
+            Result for every line, numbered from the first line after the header.
+    """
+    try:
+        content = await file.read()
+        if idempotency is not None:
+            idempotency.fingerprint_content(content)
+            if replay := await idempotency.replay(db):
+                return replay
+        content = content.decode('utf-8-sig')
+        reader = csv.DictReader(io.StringIO(content))
+        if reader.fieldnames is None or \
+                not {'name', 'size', 'quantity'} <= set(reader.fieldnames):
+            raise HTTPException(
+                status_code=422,
+                detail='CSV header must contain name, size and quantity'
+            )
+        return await _apply_intake(db, list(reader), idempotency)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=422,
+            detail='CSV file must be UTF-8 encoded'
+        )
+    except IntegrityError as error:
+        logger.error(error)
+        raise HTTPException(
+            status_code=503,
+            detail=f'Database error: {error}'
+        )
+    except HTTPException as error:
+        logger.error(error)
+        raise error
     except Exception as error:
         logger.error(error)
         raise HTTPException(
@@ -75,16 +255,28 @@ async def add_clothing_size(
 
 @router.get('/users/', response_model=list[UserResponse])
 async def get_all_user(
-        db: Annotated[AsyncSession, Depends(get_async_session)],
+        response: Response,
+        page: Annotated[PageParams, Depends(page_params)],
+        db: Annotated[AsyncSession, Depends(get_async_session_read)],
 ):
     """
-    Get users all.
+    Get users all, ordered by id and split into pages.
+
+        Params:
+            limit (integer): Page size.
+            cursor (string): Cursor of the next page from the X-Next-Cursor header.
 
         Returns:
             All users.
     """
     try:
-        user = await get_users(db)
+        user = await get_users(db, page.limit + 1, page.after_id)
+        user, next_cursor = split_page(user, page)
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+        if settings.FAST_JSON_RESPONSES:
+            return user_list_serializer.response(user, headers)
+        if headers:
+            response.headers.update(headers)
         return user
     except HTTPException as error:
         logger.error(error)
@@ -103,7 +295,7 @@ async def delete_user_by_email(
         email: EmailStr
 ):
     """
-    Delete user by email.
+    Delete user by email, their orders are kept without the user.
 
         Params:
             email (email): Email must be between 9 and 40 characters.
@@ -118,8 +310,11 @@ async def delete_user_by_email(
                 status_code=404,
                 detail=f'User with email {email} not found'
             )
+        await revoke_user_tokens(db, user)
+        user_id = user.id
         await delete_user(db, user)
         await db.commit()
+        forget_user_tokens(user_id, email)
         return user
     except IntegrityError as error:
         logger.error(error)
@@ -153,7 +348,7 @@ async def delete_clothing_by_name(
         db: Annotated[AsyncSession, Depends(get_async_session)],
 ):
     """
-    Delete clothing by name.
+    Delete clothing by name, its orders are kept without the clothing.
 
         Params:
             name (string): Only letters, characters > 3 and < 20.
@@ -169,7 +364,9 @@ async def delete_clothing_by_name(
                 detail=f'Clothing with name {name} not found'
             )
         await delete_clothing(db, clothing)
+        await publish_stock_changes(db, [StockChange(name)])
         await db.commit()
+        catalog_cache.bump()
         return clothing
     except IntegrityError as error:
         logger.error(error)
@@ -190,7 +387,7 @@ async def delete_clothing_by_name(
 
 @router.get('/orders/{email}/', response_model=list[OrdersUser])
 async def get_orders_by_email(
-        db: Annotated[AsyncSession, Depends(get_async_session)], email: EmailStr
+        db: Annotated[AsyncSession, Depends(get_async_session_read)], email: EmailStr
 ):
     """
     Get orders users by email.
@@ -208,6 +405,8 @@ async def get_orders_by_email(
                 status_code=404,
                 detail=f'The user with email {email} has no orders'
             )
+        if settings.FAST_JSON_RESPONSES:
+            return order_list_serializer.response(orders)
         return orders
     except HTTPException as error:
         logger.error(error)
@@ -272,3 +471,57 @@ async def delete_orders_user(
             status_code=500,
             detail=f'Server error: {error}'
         )
+
+
+def _stock_csv(rows: Sequence[Row]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _stock_ndjson(rows: Sequence[Row]) -> bytes:
+    return b''.join(orjson.dumps(row._asdict()) + b'\n' for row in rows)
+
+
+@router.get('/export/stock/')
+async def export_stock(
+        session_factory: Annotated[async_sessionmaker, Depends(get_async_sessionmaker_read)],
+        export_format: Annotated[Literal['csv', 'ndjson'], Query(alias='format')] = 'csv'
+):
+    """
+    Export the stock of every clothing and size, streamed row by row.
+
+        Params:
+            format (string): csv or ndjson.
+
+        Returns:
+            Rows name, size, quantity.
+    """
+    async def stock_rows():
+        try:
+            async with session_factory() as db:
+                if export_format == 'csv':
+                    yield b'name,size,quantity\r\n'
+                async for rows in stream_stock(db, chunk_size=1000):
+                    yield _stock_csv(rows) if export_format == 'csv' else _stock_ndjson(rows)
+        except Exception as error:
+            logger.error(error)
+            raise
+
+    media_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(stock_rows(), media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="stock.{export_format}"'
+    })
+
+
+@router.get('/pool/')
+async def get_pool_stats():
+    """
+    Connection pool of this worker.
+
+        Returns:
+            For the primary and the replica pool: size, connections checked in and out,
+            overflow in use, checkout timeouts and a histogram of the time spent waiting
+            for a connection.
+    """
+    return pool_stats()
@@ -1,11 +1,16 @@
 import re
 from datetime import date
+from typing import Literal
 
 from fastapi import HTTPException
-from pydantic import BaseModel, EmailStr, Field, field_validator, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, field_validator, ConfigDict, TypeAdapter
+
+from src.responses import RowSerializer
 
 letters = re.compile(r'^[а-яА-Яa-zA-Z\-]+$')
 
+MAX_INTAKE_LINES = 10000
+
 
 class CreateClothing(BaseModel):
     name: str = Field(min_length=3, max_length=20, description='Name clothing should '
@@ -58,7 +63,21 @@ class OrdersUser(BaseModel):
     name_user: str
     birthdate: date
     email_user: EmailStr
-    name_clothing: str
-    size: str
+    name_clothing: str | None = Field(description='None if the clothing was deleted')
+    size: str | None
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class IntakeLine(BaseModel):
+    line: int
+    name: str | None = None
+    size: str | None = None
+    quantity: int | None = Field(default=None, description='Stock of the size after the intake')
+    status: Literal['added', 'error']
+    detail: str | None = None
+
+
+user_list_serializer = RowSerializer(UserResponse)
+order_list_serializer = RowSerializer(OrdersUser)
+intake_lines_adapter = TypeAdapter(list[IntakeLine])
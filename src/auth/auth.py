@@ -6,32 +6,32 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from jose import JWTError
-from passlib.context import CryptContext
 from pydantic import EmailStr
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.auth.dependencies import get_user_email
+from src.auth.cache import user_cache, token_versions
+from src.auth.dependencies import get_user_email, get_token_version, bump_token_version
+from src.auth.hashing import password_hasher
 from src.auth.models import User
 from src.auth.schemas import TokenData
 from src.config import settings
 from src.database import get_async_session
 
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/token')
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
 async def authenticate_user(db: AsyncSession, email: EmailStr, password: str):
     user = await get_user_email(db, email)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -47,9 +47,27 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def user_claims(user: User) -> dict:
+    return {
+        'sub': user.email,
+        'uid': user.id,
+        'adm': user.is_admin,
+        'usr': user.is_user,
+        'ver': user.token_version,
+    }
+
+
 async def get_current_user(
         token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_session)
-):
+) -> User | TokenData:
+    """
+    Resolve the user of the access token.
+
+    With AUTH_STATELESS the verified claims are trusted and returned as TokenData, only the
+    token version of the user is read, through the token version cache. Otherwise the user
+    is loaded through the user cache. In both modes tokens issued before the last bump of
+    the user's token version are rejected.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
@@ -60,16 +78,76 @@ async def get_current_user(
         email: str = payload.get('sub')
         if email is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
+        token_data = TokenData(
+            email=email,
+            id=payload.get('uid'),
+            is_admin=payload.get('adm', False),
+            is_user=payload.get('usr', True),
+            token_version=payload.get('ver', 0),
+        )
     except JWTError:
         raise credentials_exception
-    user = await get_user_email(db, token_data.email)
+    if settings.AUTH_STATELESS:
+        if token_data.id is None:
+            raise credentials_exception
+        found, version = token_versions.get(token_data.id)
+        if not found:
+            version = await get_token_version(db, token_data.id)
+            token_versions.set(token_data.id, version)
+        if version != token_data.token_version:
+            raise credentials_exception
+        return token_data
+    user = user_cache.get(token_data.email, payload.get('exp'))
     if user is None:
+        user = await get_user_email(db, token_data.email)
+        if user is None:
+            raise credentials_exception
+        db.expunge(user)
+        user_cache.set(token_data.email, payload.get('exp'), user)
+    if user.token_version != token_data.token_version:
         raise credentials_exception
     return user
 
 
-async def get_current_admin_user(current_user: Annotated[User, Depends(get_current_user)]) -> User:
+async def get_current_user_profile(
+        current_user: Annotated[User | TokenData, Depends(get_current_user)],
+        db: AsyncSession = Depends(get_async_session)
+) -> User:
+    """
+    The full user row, loaded from the database when running in stateless mode.
+    """
+    if isinstance(current_user, User):
+        return current_user
+    user = await get_user_email(db, current_user.email)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Could not validate credentials',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+    return user
+
+
+async def revoke_user_tokens(db: AsyncSession, user: User):
+    """
+    Bump the token version of the user in the current transaction, every token issued
+    before stops working once it is committed. Call `forget_user_tokens` after the commit.
+    """
+    await bump_token_version(db, user.id)
+
+
+def forget_user_tokens(user_id: int, email: EmailStr):
+    """
+    Drop the cached user and token version of this worker after a committed revocation,
+    other workers read the new version when their cached copy expires.
+    """
+    token_versions.invalidate(user_id)
+    user_cache.invalidate(email)
+
+
+async def get_current_admin_user(
+        current_user: Annotated[User | TokenData, Depends(get_current_user)]
+) -> User | TokenData:
     if current_user.is_admin:
         return current_user
     raise HTTPException(
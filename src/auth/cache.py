@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+
+from src.auth.models import User
+from src.config import settings
+from src.metrics import registry
+
+
+class UserCache:
+    """
+    In-process TTL + LRU cache of users resolved from access tokens.
+
+    Entries are keyed by the token subject and its expiry, so a cached user never
+    outlives the token that resolved it. Cached users are detached from any session.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._users: OrderedDict[tuple[str, int], tuple[float, User]] = OrderedDict()
+
+    def get(self, subject: str, expire: int) -> User | None:
+        key = (subject, expire)
+        entry = self._users.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._users[key]
+            self.misses += 1
+            return None
+        self._users.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, subject: str, expire: int, user: User):
+        key = (subject, expire)
+        self._users[key] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(key)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, subject: str):
+        for key in [key for key in self._users if key[0] == subject]:
+            del self._users[key]
+
+    def clear(self):
+        self._users.clear()
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._users),
+            'max_size': self.max_size,
+        }
+
+
+class TokenVersions:
+    """
+    In-process TTL + LRU cache of users.token_version by user id.
+
+    Used in stateless mode, where the user row is not read on each request. The version
+    comes from the database, so a revocation committed by any worker or before a restart
+    is seen by every worker within `ttl` seconds. None is cached for deleted users.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._versions: OrderedDict[int, tuple[float, int | None]] = OrderedDict()
+
+    def get(self, user_id: int) -> tuple[bool, int | None]:
+        """
+        (found, version) of the user, found is False if the entry is missing or expired.
+        """
+        entry = self._versions.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._versions[user_id]
+            return False, None
+        self._versions.move_to_end(user_id)
+        return True, entry[1]
+
+    def set(self, user_id: int, version: int | None):
+        self._versions[user_id] = (time.monotonic() + self.ttl, version)
+        self._versions.move_to_end(user_id)
+        while len(self._versions) > self.max_size:
+            self._versions.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._versions.pop(user_id, None)
+
+    def clear(self):
+        self._versions.clear()
+
+
+user_cache = UserCache(settings.USER_CACHE_MAX_SIZE, settings.USER_CACHE_TTL_SECONDS)
+token_versions = TokenVersions(
+    settings.USER_CACHE_MAX_SIZE, settings.AUTH_TOKEN_VERSION_TTL_SECONDS
+)
+
+
+@registry.collector
+def collect_user_cache_metrics():
+    stats = user_cache.stats()
+    yield 'user_cache_hits_total', 'counter', 'Users resolved from the cache.', [
+        ({}, stats['hits'])
+    ]
+    yield 'user_cache_misses_total', 'counter', 'Users loaded from the database.', [
+        ({}, stats['misses'])
+    ]
+    yield 'user_cache_size', 'gauge', 'Users in the cache.', [({}, stats['size'])]
@@ -1,7 +1,7 @@
 from datetime import date
 
 from pydantic import EmailStr
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.models import User
@@ -28,3 +28,15 @@ async def get_admin(db: AsyncSession) -> User:
     admin = select(User).filter(User.is_admin == True) # noqa
     result = await db.execute(admin)
     return result.scalars().first()
+
+
+async def get_token_version(db: AsyncSession, user_id: int) -> int | None:
+    result = await db.execute(select(User.token_version).filter(User.id == user_id))
+    return result.scalar()
+
+
+async def bump_token_version(db: AsyncSession, user_id: int) -> int | None:
+    version = update(User).filter(User.id == user_id).values(
+        token_version=User.token_version + 1).returning(User.token_version)
+    result = await db.execute(version)
+    return result.scalar()
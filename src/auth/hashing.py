@@ -0,0 +1,100 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from src.config import settings
+from src.metrics import registry
+
+PASSWORD_HASH_SECONDS = registry.histogram(
+    'password_hash_duration_seconds', 'Time of one bcrypt hash or verify, queueing included.',
+    ('operation',)
+)
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a bounded thread or process pool instead of on the event loop.
+
+    At most `max_pending` calls may be queued or running at once, further calls are
+    rejected immediately with 503 so a login burst can not pile up behind the pool.
+    """
+
+    def __init__(self, executor: str, max_workers: int, max_pending: int):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Unknown password hasher executor: {executor}')
+        self.executor_type = executor
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='bcrypt'
+                )
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Server is busy, try again later',
+                headers={'Retry-After': '1'},
+            )
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_HASH_SECONDS.labels(func.__name__.lstrip('_')).observe(
+                time.perf_counter() - start
+            )
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    settings.PASSWORD_HASHER_EXECUTOR,
+    settings.PASSWORD_HASHER_WORKERS,
+    settings.PASSWORD_HASHER_MAX_PENDING,
+)
+
+
+@registry.collector
+def collect_password_hasher_metrics():
+    yield 'password_hash_pending', 'gauge', 'Hash and verify calls queued or running.', [
+        ({}, password_hasher.pending)
+    ]
+    yield 'password_hash_rejected_total', 'counter', 'Calls rejected with 503.', [
+        ({}, password_hasher.rejected)
+    ]
@@ -17,13 +17,15 @@ class User(Base):
     is_active: Mapped[bool] = mapped_column(default=True)
     is_admin: Mapped[bool] = mapped_column(default=False)
     is_user: Mapped[bool] = mapped_column(default=True)
+    token_version: Mapped[int] = mapped_column(default=0, server_default='0')
 
     def __str__(self):
         return (
             f'{self.__class__.__name__}(id={self.id}, name={self.name}, surname={self.surname}, '
             f'birthdate={self.birthdate}, '
             f'email={self.email}, hashed_password={self.hashed_password}, '
-            f'is_active={self.is_active}, is_admin={self.is_admin}, is_user={self.is_user}'
+            f'is_active={self.is_active}, is_admin={self.is_admin}, is_user={self.is_user}, '
+            f'token_version={self.token_version}'
         )
 
     def __repr__(self):
@@ -8,7 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.dependencies import get_user_email, add_user
 from src.auth.auth import get_password_hash, authenticate_user, create_access_token, \
-    get_current_user
+    get_current_user_profile, user_claims
 from src.config import settings
 from src.database import get_async_session
 from src.auth.schemas import User, CreateUser, Token
@@ -42,7 +42,7 @@ async def create_user(user: CreateUser, db: AsyncSession = Depends(get_async_ses
                 status_code=400,
                 detail='Email already registered'
             )
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash(user.password)
         db_add_user = await add_user(
             db, user.name, user.surname, user.birthdate, user.email,
             hashed_password
@@ -93,7 +93,7 @@ async def login_for_access_token(
             )
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={'sub': user.email}, expires_delta=access_token_expires
+            data=user_claims(user), expires_delta=access_token_expires
         )
         return {
             'access_token': access_token,
@@ -111,7 +111,7 @@ async def login_for_access_token(
 
 
 @router.get('/users/me/', response_model=User)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_user_profile)):
     """
     Get current user.
 
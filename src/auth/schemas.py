@@ -68,3 +68,7 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: EmailStr | None = None
+    id: int | None = None
+    is_admin: bool = False
+    is_user: bool = True
+    token_version: int = 0
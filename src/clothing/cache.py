@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Awaitable, Callable, Iterable, NamedTuple, Hashable
+
+from fastapi import Request, Response
+
+from src.config import settings
+from src.metrics import registry
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+    headers: dict[str, str]
+
+    @classmethod
+    def of(cls, body: bytes, headers: dict[str, str] | None = None) -> 'CachedResponse':
+        return cls(f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"', body, headers or {})
+
+    def to_response(self, request: Request) -> Response:
+        """
+        304 without a body if the client already has this version, the cached bytes otherwise.
+        """
+        if_none_match = request.headers.get('if-none-match', '')
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        if self.etag in tags or '*' in tags:
+            return Response(status_code=304, headers={**self.headers, 'ETag': self.etag})
+        return Response(
+            content=self.body, media_type='application/json',
+            headers={**self.headers, 'ETag': self.etag}
+        )
+
+
+class CatalogCache:
+    """
+    Pre-serialized catalog responses, valid for one catalog version.
+
+    Every write that changes the catalog calls `bump`, which makes all cached responses
+    stale at once. Writes that only change the stock of some clothing call `invalidate`
+    with the keys of their sizes, the list pages stay cached. The TTL bounds how long a
+    worker serves responses that were made stale by a write handled in another worker.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._responses: OrderedDict[Hashable, tuple[float, CachedResponse]] = OrderedDict()
+        # Version of the last bump, and of the last invalidation of single keys since.
+        self._bumped = 0
+        self._invalidated: dict[Hashable, int] = {}
+
+    def bump(self):
+        self.version += 1
+        self._bumped = self.version
+        self._invalidated.clear()
+        self._responses.clear()
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        self.version += 1
+        for key in keys:
+            self._responses.pop(key, None)
+            self._invalidated[key] = self.version
+        if len(self._invalidated) > self.max_size:
+            # Only reads still in flight can be older than the forgotten keys.
+            self._bumped = self.version
+            self._invalidated.clear()
+
+    def get(self, key: Hashable) -> CachedResponse | None:
+        entry = self._responses.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._responses.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(
+            self, key: Hashable, version: int, body: bytes, headers: dict[str, str] | None = None
+    ) -> CachedResponse:
+        """
+        Cache `body` if the key was not invalidated since `version`, which must be taken
+        before the query so a concurrent bump or invalidation is never lost.
+        """
+        cached = CachedResponse.of(body, headers)
+        if version >= max(self._bumped, self._invalidated.get(key, 0)):
+            self._responses[key] = (time.monotonic() + self.ttl, cached)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+        return cached
+
+    def stats(self) -> dict:
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._responses),
+        }
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight call and its result.
+
+    The call runs in its own task, so a caller that goes away does not cancel it for the
+    others. A successful result is shared for `ttl` more seconds, failures are not kept.
+    The key must change whenever the result would, e.g. by including the catalog version.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: dict[Hashable, tuple[float, asyncio.Task]] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable]):
+        now = time.monotonic()
+        flight = self._flights.get(key)
+        if flight is not None and flight[0] > now:
+            self.coalesced += 1
+            task = flight[1]
+        else:
+            if len(self._flights) >= self.max_size:
+                self._flights = {
+                    key: flight for key, flight in self._flights.items() if flight[0] > now
+                }
+            self.calls += 1
+            task = asyncio.ensure_future(call())
+            self._flights[key] = (math.inf, task)
+            task.add_done_callback(partial(self._finished, key))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        flight = self._flights.get(key)
+        if flight is None or flight[1] is not task:
+            return
+        if task.cancelled() or task.exception() is not None:
+            del self._flights[key]
+        else:
+            self._flights[key] = (time.monotonic() + self.ttl, task)
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'size': len(self._flights)}
+
+
+catalog_cache = CatalogCache(settings.CATALOG_CACHE_MAX_SIZE, settings.CATALOG_CACHE_TTL_SECONDS)
+sizes_single_flight = SingleFlight(
+    settings.CATALOG_SINGLE_FLIGHT_TTL_SECONDS, settings.CATALOG_CACHE_MAX_SIZE
+)
+
+
+@registry.collector
+def collect_catalog_cache_metrics():
+    stats = catalog_cache.stats()
+    yield 'catalog_cache_hits_total', 'counter', 'Catalog responses served from the cache.', [
+        ({}, stats['hits'])
+    ]
+    yield 'catalog_cache_misses_total', 'counter', 'Catalog responses built from a query.', [
+        ({}, stats['misses'])
+    ]
+    yield 'catalog_cache_size', 'gauge', 'Responses in the cache.', [({}, stats['size'])]
+    yield 'catalog_cache_version', 'gauge', 'Catalog version of this worker.', [
+        ({}, stats['version'])
+    ]
+    flights = sizes_single_flight.stats()
+    yield 'catalog_sizes_queries_total', 'counter', 'Size lookups that ran a query.', [
+        ({}, flights['calls'])
+    ]
+    yield 'catalog_sizes_coalesced_total', 'counter', 'Size lookups that joined another.', [
+        ({}, flights['coalesced'])
+    ]
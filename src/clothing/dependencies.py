@@ -1,19 +1,70 @@
-from sqlalchemy import select
+from typing import Sequence
+
+from sqlalchemy import select, and_, any_, bindparam, Row, String
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from src.clothing.models import Clothing
+from src.clothing.models import Clothing, Size
+
 
+async def get_available_sizes(db: AsyncSession, clothing_name: str) -> list[Row] | None:
+    """
+    (size, quantity) rows of the sizes in stock, None if there is no such clothing.
 
-async def get_clothing_and_size(db: AsyncSession, clothing_name: str) -> Clothing:
-    clothing_sizes = select(Clothing).filter(Clothing.name == clothing_name).options(
-        selectinload(Clothing.sizes)
-    )
-    result = await db.execute(clothing_sizes)
-    return result.scalars().first()
+    One query: the outer join keeps a row of NULLs for clothing without sizes in stock,
+    the `quantity > 0` filter is served by the partial index on sizes.
+    """
+    sizes = select(Size.size, Size.quantity).select_from(Clothing).outerjoin(
+        Size, and_(Size.clothing_id == Clothing.id, Size.quantity > 0)
+    ).filter(Clothing.name == clothing_name)
+    result = await db.execute(sizes)
+    rows = result.all()
+    if not rows:
+        return None
+    return [row for row in rows if row.size is not None]
 
 
-async def get_clothing_all(db: AsyncSession) -> [Clothing]:
-    clothing = select(Clothing)
+async def get_clothing_all(
+        db: AsyncSession, limit: int, after_id: int | None = None
+) -> Sequence[Row]:
+    """
+    (id, name) rows, without loading `Clothing` entities.
+    """
+    clothing = select(Clothing.id, Clothing.name).order_by(Clothing.id).limit(limit)
+    if after_id is not None:
+        clothing = clothing.filter(Clothing.id > after_id)
     result = await db.execute(clothing)
-    return result.scalars().all()
+    return result.all()
+
+
+async def get_available_sizes_many(
+        db: AsyncSession, clothing_names: list[str]
+) -> dict[str, list[Row]]:
+    """
+    Sizes in stock for many clothing at once, in one `name = ANY(:names)` query.
+
+    Clothing that does not exist is missing from the result, clothing without sizes in
+    stock maps to an empty list.
+    """
+    sizes = select(Clothing.name, Size.size, Size.quantity).select_from(Clothing).outerjoin(
+        Size, and_(Size.clothing_id == Clothing.id, Size.quantity > 0)
+    ).filter(Clothing.name == any_(bindparam('names', clothing_names, type_=ARRAY(String))))
+    result = await db.execute(sizes)
+    available = {}
+    for row in result:
+        available.setdefault(row.name, [])
+        if row.size is not None:
+            available[row.name].append(row)
+    return available
+
+
+async def get_stock(db: AsyncSession) -> Sequence[Row]:
+    """
+    (name, size, quantity) rows of all clothing ordered by id, with a row of NULL size
+    and quantity for clothing without sizes.
+    """
+    stock = select(Clothing.name, Size.size, Size.quantity).outerjoin(
+        Size, Size.clothing_id == Clothing.id
+    ).order_by(Clothing.id)
+    result = await db.execute(stock)
+    return result.all()
@@ -0,0 +1,244 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Iterable, Iterator, NamedTuple
+
+import asyncpg
+import orjson
+from sqlalchemy import func, select, bindparam, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.clothing.cache import catalog_cache
+from src.config import settings
+from src.logger_error import logger
+from src.metrics import registry
+
+# NOTIFY payloads must stay below 8000 bytes.
+MAX_PAYLOAD_BYTES = 7000
+
+
+class StockChange(NamedTuple):
+    """
+    New quantity of a size, or the deletion of a clothing when `size` is None.
+    """
+    name: str
+    size: str | None = None
+    quantity: int | None = None
+
+
+class SubscriptionOverflow(Exception):
+    """
+    The subscriber fell behind or events were lost, it has to read the stock again.
+    """
+
+
+class Subscription:
+    """
+    Stock changes waiting for one client.
+
+    Changes of the same size are coalesced, only the newest quantity is kept, so a slow
+    client receives fewer events rather than a growing backlog. More than `max_pending`
+    different sizes waiting overflows the subscription.
+    """
+
+    def __init__(self, names: frozenset[str] | None, max_pending: int):
+        self.names = names
+        self.max_pending = max_pending
+        self.overflowed = False
+        self._pending: dict[tuple[str, str | None], StockChange] = {}
+        self._ready = asyncio.Event()
+
+    def push(self, change: StockChange):
+        if self.names is not None and change.name not in self.names:
+            return
+        if change.size is None:
+            for key in [key for key in self._pending if key[0] == change.name]:
+                del self._pending[key]
+        key = (change.name, change.size)
+        self._pending.pop(key, None)
+        self._pending[key] = change
+        if len(self._pending) > self.max_pending:
+            self.overflow()
+        self._ready.set()
+
+    def overflow(self):
+        self.overflowed = True
+        self._pending.clear()
+        self._ready.set()
+
+    async def next(self, timeout: float) -> list[StockChange]:
+        """
+        Changes since the last call in the order of their last update, an empty list
+        after `timeout` seconds without changes.
+
+        Raises SubscriptionOverflow once the subscription overflowed.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        if self.overflowed:
+            raise SubscriptionOverflow()
+        changes = list(self._pending.values())
+        self._pending.clear()
+        return changes
+
+
+class StockEvents:
+    """
+    In-process fan-out of the stock changes that every worker receives with LISTEN.
+
+    Writers send their changes with NOTIFY in the transaction of the write, so the
+    changes reach the listeners only after the commit and never for a rollback. Every
+    received change also invalidates the sizes of its clothing in the catalog cache of
+    the worker, a deleted clothing the whole cache, which makes writes of other workers
+    visible before the cache TTL.
+    """
+
+    def __init__(self, channel: str, max_subscribers: int, max_pending: int,
+                 reconnect_interval: float):
+        self.channel = channel
+        self.max_subscribers = max_subscribers
+        self.max_pending = max_pending
+        self.reconnect_interval = reconnect_interval
+        self.subscriptions: set[Subscription] = set()
+        self.received = 0
+        self.overflows = 0
+        self.connected = False
+        self._task: asyncio.Task | None = None
+
+    @contextmanager
+    def subscribe(self, names: Iterable[str] | None = None) -> Iterator[Subscription]:
+        """
+        Subscribe to the changes of `names`, of all clothing if None.
+        """
+        subscription = Subscription(
+            frozenset(names) if names is not None else None, self.max_pending
+        )
+        self.subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self.subscriptions.discard(subscription)
+
+    @property
+    def full(self) -> bool:
+        return len(self.subscriptions) >= self.max_subscribers
+
+    def dispatch(self, payload: str):
+        changes = [StockChange(*change) for change in orjson.loads(payload)]
+        self.received += len(changes)
+        if any(change.size is None for change in changes):
+            catalog_cache.bump()
+        else:
+            catalog_cache.invalidate({('sizes', change.name) for change in changes})
+        for subscription in self.subscriptions:
+            overflowed = subscription.overflowed
+            for change in changes:
+                subscription.push(change)
+            if subscription.overflowed and not overflowed:
+                self.overflows += 1
+
+    def _reset_subscriptions(self):
+        # Changes made while no connection listened are lost, clients read the stock again.
+        catalog_cache.bump()
+        for subscription in self.subscriptions:
+            subscription.overflow()
+        self.overflows += len(self.subscriptions)
+
+    async def listen(self, dsn: str):
+        """
+        Keep a connection listening on the channel, reconnect when it is lost.
+        """
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(
+                    self.channel, lambda _, __, ___, payload: self.dispatch(payload)
+                )
+                self._reset_subscriptions()
+                self.connected = True
+                await closed.wait()
+                logger.error('Stock events connection lost')
+            except Exception as error:
+                logger.error(error)
+            finally:
+                self.connected = False
+                if connection is not None:
+                    await connection.close()
+            await asyncio.sleep(self.reconnect_interval)
+
+    def start(self, dsn: str):
+        self._task = asyncio.create_task(self.listen(dsn))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _payloads(changes: Iterable[StockChange]) -> list[str]:
+    payloads = []
+    chunk = []
+    size = 2
+    for change in changes:
+        encoded = orjson.dumps(tuple(change))
+        if chunk and size + len(encoded) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append(b'[' + b','.join(chunk) + b']')
+            chunk = []
+            size = 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        payloads.append(b'[' + b','.join(chunk) + b']')
+    return [payload.decode() for payload in payloads]
+
+
+async def publish_stock_changes(db: AsyncSession, changes: Iterable[StockChange]):
+    """
+    NOTIFY the changes in the current transaction with one statement, nothing if stock
+    events are disabled.
+    """
+    if not settings.STOCK_EVENTS_ENABLED:
+        return
+    payloads = _payloads(changes)
+    if not payloads:
+        return
+    payload = func.unnest(
+        bindparam('payloads', payloads, type_=ARRAY(String))
+    ).column_valued('payload')
+    await db.execute(select(func.pg_notify(stock_events.channel, payload)))
+
+
+stock_events = StockEvents(
+    settings.STOCK_EVENTS_CHANNEL,
+    settings.STOCK_EVENTS_MAX_SUBSCRIBERS,
+    settings.STOCK_EVENTS_MAX_PENDING,
+    settings.STOCK_EVENTS_RECONNECT_SECONDS,
+)
+
+
+@registry.collector
+def collect_stock_events_metrics():
+    if not settings.STOCK_EVENTS_ENABLED:
+        return
+    yield 'stock_events_connected', 'gauge', 'Whether this worker listens for changes.', [
+        ({}, int(stock_events.connected))
+    ]
+    yield 'stock_events_subscribers', 'gauge', 'Open stock event streams.', [
+        ({}, len(stock_events.subscriptions))
+    ]
+    yield 'stock_events_received_total', 'counter', 'Stock changes received.', [
+        ({}, stock_events.received)
+    ]
+    yield 'stock_events_overflows_total', 'counter', 'Streams reset because they fell behind.', [
+        ({}, stock_events.overflows)
+    ]
@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint, text
 from sqlalchemy.orm import mapped_column, Mapped, relationship
 
 from src.database import Base
@@ -22,6 +22,11 @@ class Clothing(Base):
 
 class Size(Base):
     __tablename__ = 'sizes'
+    __table_args__ = (
+        UniqueConstraint('clothing_id', 'size', name='uq_sizes_clothing_id_size'),
+        Index('ix_sizes_clothing_id_available', 'clothing_id',
+              postgresql_where=text('quantity > 0'), postgresql_include=['size', 'quantity']),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     clothing_id: Mapped[int] = mapped_column(ForeignKey('clothing.id', ondelete='CASCADE'),
@@ -1,13 +1,23 @@
+from functools import partial
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, Path, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
+import orjson
+from fastapi import APIRouter, Depends, Path, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from src.auth.auth import get_current_user
-from src.clothing.dependencies import get_clothing_all, get_clothing_and_size
-from src.clothing.schemas import ClothingResponse, SizeResponse
-from src.database import get_async_session
+from src.clothing.cache import CachedResponse, catalog_cache, sizes_single_flight
+from src.clothing.events import stock_events, Subscription, SubscriptionOverflow
+from src.clothing.dependencies import get_clothing_all, get_available_sizes, \
+    get_available_sizes_many
+from src.clothing.snapshot import stock_snapshot, SnapshotUnavailable
+from src.clothing.schemas import ClothingResponse, SizeResponse, SizesRequest, \
+    clothing_list_adapter, size_list_adapter, clothing_list_serializer
+from src.config import settings
+from src.database import get_async_session_read, get_async_sessionmaker_read
 from src.logger_error import logger
+from src.pagination import PageParams, page_params, split_page, NEXT_CURSOR_HEADER
 
 router = APIRouter(
     prefix='/clothing',
@@ -17,16 +27,38 @@ router = APIRouter(
 
 
 @router.get('/', response_model=list[ClothingResponse])
-async def get_all_clothing(db: Annotated[AsyncSession, Depends(get_async_session)]):
+async def get_all_clothing(
+        request: Request,
+        page: Annotated[PageParams, Depends(page_params)],
+        db: Annotated[AsyncSession, Depends(get_async_session_read)]
+):
     """
-    Returning all clothing.
+    Returning all clothing, ordered by id and split into pages.
+
+        Params:
+            limit (integer): Page size.
+            cursor (string): Cursor of the next page from the X-Next-Cursor header.
 
         Returns:
             All clothing.
     """
     try:
-        clothing = await get_clothing_all(db)
-        return clothing
+        cached = catalog_cache.get(('clothing', page))
+        if cached is None:
+            version = catalog_cache.version
+            clothing = await get_clothing_all(db, page.limit + 1, page.after_id)
+            clothing, next_cursor = split_page(clothing, page)
+            if settings.FAST_JSON_RESPONSES:
+                body = clothing_list_serializer.dumps(clothing)
+            else:
+                body = clothing_list_adapter.dump_json(
+                    clothing_list_adapter.validate_python(clothing, from_attributes=True)
+                )
+            cached = catalog_cache.set(
+                ('clothing', page), version, body,
+                {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+            )
+        return cached.to_response(request)
     except HTTPException as error:
         logger.error(error)
         raise error
@@ -38,6 +70,28 @@ async def get_all_clothing(db: Annotated[AsyncSession, Depends(get_async_session
         )
 
 
+async def _load_available_sizes(session_factory: async_sessionmaker, name: str):
+    # Own session: the lookup is shared by concurrent requests and may outlive the first.
+    async with session_factory() as db:
+        return await get_available_sizes(db, name)
+
+
+def _sizes_body(name: str, size) -> bytes:
+    if size is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f'Clothing with name {name} not found'
+        )
+    if not size:
+        raise HTTPException(
+            status_code=409,
+            detail='There are no sizes for this clothing'
+        )
+    return size_list_adapter.dump_json(
+        size_list_adapter.validate_python(size, from_attributes=True)
+    )
+
+
 @router.get('/{name}/sizes/', response_model=list[SizeResponse])
 async def get_clothing_sizes(
         name: Annotated[
@@ -50,7 +104,8 @@ async def get_clothing_sizes(
             max_length=20,
             pattern='^[A-ZА-Я][a-zа-я]+$'
         )],
-        db: Annotated[AsyncSession, Depends(get_async_session)]
+        request: Request,
+        session_factory: Annotated[async_sessionmaker, Depends(get_async_sessionmaker_read)]
 ):
     """
     Get clothing by name.
@@ -62,19 +117,50 @@ async def get_clothing_sizes(
             Sizes for clothing.
     """
     try:
-        clothing_size = await get_clothing_and_size(db, name)
-        if not clothing_size:
-            raise HTTPException(
-                status_code=404,
-                detail=f'Clothing with name {name} not found'
-            )
-        size = [o for o in clothing_size.sizes if o.quantity > 0]
-        if not size:
-            raise HTTPException(
-                status_code=409,
-                detail='There are no sizes for this clothing'
+        if settings.STOCK_SNAPSHOT_ENABLED:
+            # The snapshot is fresher than the cache of this worker and costs no query either.
+            try:
+                size = stock_snapshot.sizes(name)
+            except SnapshotUnavailable:
+                pass
+            else:
+                return CachedResponse.of(_sizes_body(name, size)).to_response(request)
+        cached = catalog_cache.get(('sizes', name))
+        if cached is None:
+            version = catalog_cache.version
+            # One query shared by the concurrent requests for the same clothing.
+            size = await sizes_single_flight.do(
+                (name, version), partial(_load_available_sizes, session_factory, name)
             )
-        return size
+            cached = catalog_cache.set(('sizes', name), version, _sizes_body(name, size))
+        return cached.to_response(request)
+    except HTTPException as error:
+        logger.error(error)
+        raise error
+    except Exception as error:
+        logger.error(error)
+        raise HTTPException(
+            status_code=500,
+            detail=f'Server error: {error}'
+        )
+
+
+@router.post('/sizes/', response_model=dict[str, list[SizeResponse]])
+async def get_clothing_sizes_many(
+        sizes_request: SizesRequest,
+        db: Annotated[AsyncSession, Depends(get_async_session_read)]
+):
+    """
+    Get sizes for many clothing in one request.
+
+        Params:
+            names (list of strings): Up to 300 names clothing, first character capital.
+
+        Returns:
+            Sizes in stock by name clothing, clothing that does not exist is left out.
+    """
+    try:
+        return await get_available_sizes_many(db, list(set(sizes_request.names)))
     except HTTPException as error:
         logger.error(error)
         raise error
@@ -84,3 +170,66 @@ async def get_clothing_sizes(
             status_code=500,
             detail=f'Server error: {error}'
         )
+
+
+async def _stock_event_stream(subscription: Subscription):
+    # Tell EventSource clients to reconnect after 3 seconds if the stream breaks.
+    yield b'retry: 3000\n\n'
+    while True:
+        try:
+            changes = await subscription.next(settings.STOCK_EVENTS_HEARTBEAT_SECONDS)
+        except SubscriptionOverflow:
+            yield b'event: reset\ndata: {}\n\n'
+            return
+        if not changes:
+            # Keeps proxies from closing an idle stream.
+            yield b': ping\n\n'
+        for change in changes:
+            if change.size is None:
+                yield b'event: deleted\ndata: ' + orjson.dumps({'name': change.name}) + b'\n\n'
+            else:
+                yield b'event: stock\ndata: ' + orjson.dumps(change._asdict()) + b'\n\n'
+
+
+async def _subscribed(names: list[str] | None):
+    with stock_events.subscribe(names) as subscription:
+        async for event in _stock_event_stream(subscription):
+            yield event
+
+
+@router.get('/stock/events/', response_class=StreamingResponse)
+async def get_stock_events(
+        name: Annotated[
+            list[str] | None,
+            Query(
+                title='Names clothing',
+                description='Only changes of these clothing, all clothing if not given',
+                max_length=300
+            )] = None
+):
+    """
+    Stream of stock changes as server-sent events.
+
+        Params:
+            name (list of strings): Names clothing, all clothing if not given.
+
+        Returns:
+            `stock` events with name, size and new quantity, `deleted` events with the name
+            of deleted clothing. After a `reset` event the client has missed changes, it
+            reads the sizes again and reconnects.
+    """
+    if not settings.STOCK_EVENTS_ENABLED:
+        raise HTTPException(
+            status_code=404,
+            detail='Stock events are disabled'
+        )
+    if stock_events.full:
+        logger.error('Too many stock event streams')
+        raise HTTPException(
+            status_code=503,
+            detail='Too many stock event streams, try again later'
+        )
+    return StreamingResponse(
+        _subscribed(name), media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
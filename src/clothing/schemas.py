@@ -1,4 +1,10 @@
-from pydantic import BaseModel, ConfigDict
+from typing import Annotated
+
+from pydantic import BaseModel, ConfigDict, TypeAdapter, Field, StringConstraints
+
+from src.responses import RowSerializer
+
+MAX_NAMES_PER_REQUEST = 300
 
 
 class ClothingResponse(BaseModel):
@@ -10,3 +16,15 @@ class SizeResponse(BaseModel):
     quantity: int
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class SizesRequest(BaseModel):
+    names: list[Annotated[str, StringConstraints(
+        min_length=3, max_length=20, pattern='^[A-ZА-Я][a-zа-я]+$'
+    )]] = Field(min_length=1, max_length=MAX_NAMES_PER_REQUEST,
+                description='Names clothing, first character capital, example: "Shirt"')
+
+
+clothing_list_adapter = TypeAdapter(list[ClothingResponse])
+size_list_adapter = TypeAdapter(list[SizeResponse])
+clothing_list_serializer = RowSerializer(ClothingResponse)
@@ -0,0 +1,285 @@
+import array
+import asyncio
+import fcntl
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterable, NamedTuple
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.clothing.dependencies import get_stock
+from src.config import settings
+from src.logger_error import logger
+from src.metrics import registry
+
+SIZES = ('XXS', 'XS', 'S', 'M', 'L', 'XL', 'XXL', 'XXXL')
+SIZE_SLOTS = {size: slot for slot, size in enumerate(SIZES)}
+NAME_BYTES = 64
+READ_ATTEMPTS = 8
+# sequence, names version, number of clothing, complete flag, refreshed at (unix time)
+HEADER = struct.Struct('=QQIId')
+
+
+class StockSize(NamedTuple):
+    size: str
+    quantity: int
+
+
+class SnapshotUnavailable(Exception):
+    """
+    The snapshot can not answer, the caller falls back to the database.
+    """
+
+
+class StockSnapshot:
+    """
+    Stock of every clothing in shared memory, written by one worker and read by all.
+
+    Layout: a header, then `capacity` rows of 8 int32 quantities in the order of `SIZES`,
+    then `capacity` UTF-8 names of `NAME_BYTES` bytes. Row `i` holds the stock of name `i`.
+    The worker that holds the flock on `lock_path` rereads the stock every `interval`
+    seconds, the others retry the lock so one of them takes over if it dies.
+
+    Writes are guarded by a sequence number (seqlock): it is odd while a write is in
+    progress, a reader retries if it was odd or changed while it copied the row. Readers
+    rebuild their local name to row index only when the names version changes. A snapshot
+    older than `max_age` is not used.
+    """
+
+    def __init__(self, name: str, capacity: int, lock_path: str, interval: float,
+                 max_age: float):
+        self.name = name
+        self.capacity = capacity
+        self.lock_path = lock_path
+        self.interval = interval
+        self.max_age = max_age
+        self.is_refresher = False
+        self.reads = 0
+        self.torn_reads = 0
+        self.unavailable = 0
+        self._shm: shared_memory.SharedMemory | None = None
+        self._quantities: memoryview | None = None
+        self._lock_fd: int | None = None
+        self._attach_after = 0.0
+        self._index: dict[str, int] = {}
+        self._names_version = -1
+        self._written_names: list[str] = []
+        self._task: asyncio.Task | None = None
+
+    @property
+    def size_bytes(self) -> int:
+        return HEADER.size + self.capacity * (len(SIZES) * 4 + NAME_BYTES)
+
+    def _open(self, create: bool) -> bool:
+        try:
+            shm = shared_memory.SharedMemory(self.name, create=create, size=self.size_bytes)
+        except FileNotFoundError:
+            return False
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(self.name)
+            if shm.size < self.size_bytes:
+                shm.close()
+                shm.unlink()
+                shm = shared_memory.SharedMemory(self.name, create=True, size=self.size_bytes)
+        # The segment outlives any single worker, the tracker would unlink it on exit.
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        if shm.size < self.size_bytes:
+            shm.close()
+            return False
+        self._shm = shm
+        self._quantities = shm.buf[
+            HEADER.size:HEADER.size + self.capacity * len(SIZES) * 4
+        ].cast('i')
+        self._names_version = -1
+        self._written_names = []
+        return True
+
+    def _close(self):
+        if self._shm is not None:
+            self._quantities.release()
+            self._shm.close()
+            self._shm = None
+            self._quantities = None
+
+    def _read_names(self, count: int) -> dict[str, int]:
+        offset = HEADER.size + self.capacity * len(SIZES) * 4
+        names = bytes(self._shm.buf[offset:offset + count * NAME_BYTES])
+        # A torn table may hold half written names, the sequence check discards it.
+        return {
+            name.rstrip(b'\0').decode(errors='replace'): slot
+            for slot, name in enumerate(
+                names[start:start + NAME_BYTES] for start in range(0, len(names), NAME_BYTES)
+            )
+        }
+
+    def sizes(self, clothing_name: str) -> list[StockSize] | None:
+        """
+        Sizes in stock of the clothing, None if there is no such clothing.
+
+        Raises SnapshotUnavailable if there is no fresh snapshot.
+        """
+        if self._shm is None:
+            if time.monotonic() < self._attach_after or not self._open(create=False):
+                self._attach_after = time.monotonic() + self.interval
+                self.unavailable += 1
+                raise SnapshotUnavailable()
+        buffer = self._shm.buf
+        for _ in range(READ_ATTEMPTS):
+            sequence, names_version, count, complete, refreshed_at = HEADER.unpack_from(buffer)
+            if sequence % 2:
+                self.torn_reads += 1
+                continue
+            if time.time() - refreshed_at > self.max_age:
+                # The refresher is gone or has replaced the segment, attach again later.
+                if not self.is_refresher:
+                    self._close()
+                    self._attach_after = time.monotonic() + self.interval
+                self.unavailable += 1
+                raise SnapshotUnavailable()
+            index = self._index
+            if names_version != self._names_version:
+                index = self._read_names(count)
+            slot = index.get(clothing_name)
+            if slot is not None:
+                quantities = self._quantities[slot * len(SIZES):(slot + 1) * len(SIZES)]
+                quantities = quantities.tolist()
+            if HEADER.unpack_from(buffer)[0] != sequence:
+                self.torn_reads += 1
+                continue
+            self._index, self._names_version = index, names_version
+            self.reads += 1
+            if slot is None:
+                if complete:
+                    return None
+                self.unavailable += 1
+                raise SnapshotUnavailable()
+            return [StockSize(size, quantity)
+                    for size, quantity in zip(SIZES, quantities) if quantity > 0]
+        self.unavailable += 1
+        raise SnapshotUnavailable()
+
+    def write(self, rows: Iterable[tuple[str, str | None, int | None]]):
+        """
+        Replace the snapshot with (name, size, quantity) rows ordered by clothing.
+        """
+        names: list[str] = []
+        slots: dict[str, int] = {}
+        quantities = array.array('i')
+        complete = True
+        for name, size, quantity in rows:
+            slot = slots.get(name)
+            if slot is None:
+                if len(names) == self.capacity or len(name.encode()) > NAME_BYTES:
+                    complete = False
+                    continue
+                slot = slots[name] = len(names)
+                names.append(name)
+                quantities.extend([0] * len(SIZES))
+            if size in SIZE_SLOTS and quantity:
+                quantities[slot * len(SIZES) + SIZE_SLOTS[size]] = min(quantity, 2 ** 31 - 1)
+        buffer = self._shm.buf
+        sequence, names_version, *_ = HEADER.unpack_from(buffer)
+        HEADER.pack_into(buffer, 0, sequence + 1, names_version, 0, 0, 0.0)
+        if names != self._written_names:
+            offset = HEADER.size + self.capacity * len(SIZES) * 4
+            table = b''.join(name.encode().ljust(NAME_BYTES, b'\0') for name in names)
+            buffer[offset:offset + len(table)] = table
+            names_version += 1
+            self._written_names = names
+        self._quantities[:len(quantities)] = quantities
+        HEADER.pack_into(
+            buffer, 0, sequence + 2, names_version, len(names), complete, time.time()
+        )
+
+    def _acquire(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        self._close()
+        self._open(create=True)
+        self.is_refresher = True
+        return True
+
+    async def refresh(self, session_factory: async_sessionmaker):
+        async with session_factory() as db:
+            rows = await get_stock(db)
+        self.write(rows)
+
+    async def run(self, session_factory: async_sessionmaker):
+        while True:
+            try:
+                if self.is_refresher or self._acquire():
+                    await self.refresh(session_factory)
+            except Exception as error:
+                logger.error(error)
+            await asyncio.sleep(self.interval)
+
+    def start(self, session_factory: async_sessionmaker):
+        self._task = asyncio.create_task(self.run(session_factory))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_refresher:
+            # Readers notice the missing refresher by the age of the snapshot.
+            resource_tracker.register(self._shm._name, 'shared_memory')
+            self._shm.unlink()
+            os.close(self._lock_fd)
+            self._lock_fd = None
+            self.is_refresher = False
+        self._close()
+
+    def stats(self) -> dict:
+        age = None
+        if self._shm is not None:
+            age = time.time() - HEADER.unpack_from(self._shm.buf)[4]
+        return {
+            'refresher': self.is_refresher,
+            'reads': self.reads,
+            'torn_reads': self.torn_reads,
+            'unavailable': self.unavailable,
+            'age_seconds': age,
+        }
+
+
+stock_snapshot = StockSnapshot(
+    settings.STOCK_SNAPSHOT_NAME,
+    settings.STOCK_SNAPSHOT_CAPACITY,
+    settings.STOCK_SNAPSHOT_LOCK_PATH,
+    settings.STOCK_SNAPSHOT_INTERVAL_SECONDS,
+    settings.STOCK_SNAPSHOT_MAX_AGE_SECONDS,
+)
+
+
+@registry.collector
+def collect_stock_snapshot_metrics():
+    if not settings.STOCK_SNAPSHOT_ENABLED:
+        return
+    stats = stock_snapshot.stats()
+    yield 'stock_snapshot_refresher', 'gauge', 'Whether this worker writes the snapshot.', [
+        ({}, int(stats['refresher']))
+    ]
+    yield 'stock_snapshot_reads_total', 'counter', 'Lookups answered by the snapshot.', [
+        ({}, stats['reads'])
+    ]
+    yield 'stock_snapshot_torn_reads_total', 'counter', 'Reads retried during a write.', [
+        ({}, stats['torn_reads'])
+    ]
+    yield 'stock_snapshot_unavailable_total', 'counter', 'Lookups sent to the database.', [
+        ({}, stats['unavailable'])
+    ]
+    if stats['age_seconds'] is not None:
+        yield 'stock_snapshot_age_seconds', 'gauge', 'Time since the last refresh.', [
+            ({}, stats['age_seconds'])
+        ]
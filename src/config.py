@@ -9,25 +9,85 @@ class Settings(BaseSettings):
     DB_NAME: str
     DB_PASS: str
     DB_USER: str
+    # Optional read replica with the same name and credentials, GET endpoints read from it.
+    DB_HOST_REPLICA: str | None = None
+    DB_PORT_REPLICA: int | None = None
     DB_HOST_TEST: str
     DB_PORT_TEST: str
     DB_NAME_TEST: str
     DB_PASS_TEST: str
     DB_USER_TEST: str
+    # Every gunicorn worker has its own pool: workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    # must stay below max_connections of Postgres.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 5
+    DB_POOL_TIMEOUT: float = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 500
+    DB_ECHO: bool = False
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    AUTH_STATELESS: bool = False
+    # How long a worker trusts its copy of a token version, the delay of a revocation.
+    AUTH_TOKEN_VERSION_TTL_SECONDS: float = 5
     NAME_ADMIN: str
     SURNAME_ADMIN: str
     BIRTHDATE_ADMIN: date  # 2021-12-30
     EMAIL_ADMIN: str
     PASSWORD_ADMIN: str
+    USER_CACHE_MAX_SIZE: int = 1024
+    USER_CACHE_TTL_SECONDS: float = 60
+    PASSWORD_HASHER_EXECUTOR: str = 'thread'  # thread or process
+    PASSWORD_HASHER_WORKERS: int = 2
+    PASSWORD_HASHER_MAX_PENDING: int = 32
+    CATALOG_CACHE_MAX_SIZE: int = 1024
+    CATALOG_CACHE_TTL_SECONDS: float = 5
+    CATALOG_SINGLE_FLIGHT_TTL_SECONDS: float = 0.1
+    STOCK_SNAPSHOT_ENABLED: bool = False
+    STOCK_SNAPSHOT_NAME: str = 'clothing_stock'
+    STOCK_SNAPSHOT_LOCK_PATH: str = '/tmp/clothing_stock.lock'
+    STOCK_SNAPSHOT_CAPACITY: int = 65536  # clothing items, 8 x int32 + 64 bytes of name each
+    STOCK_SNAPSHOT_INTERVAL_SECONDS: float = 0.5
+    STOCK_SNAPSHOT_MAX_AGE_SECONDS: float = 2
+    STOCK_EVENTS_ENABLED: bool = False
+    STOCK_EVENTS_CHANNEL: str = 'stock_changes'
+    STOCK_EVENTS_MAX_SUBSCRIBERS: int = 1000  # open streams per worker
+    STOCK_EVENTS_MAX_PENDING: int = 256  # sizes waiting for a slow client before it is reset
+    STOCK_EVENTS_HEARTBEAT_SECONDS: float = 15
+    STOCK_EVENTS_RECONNECT_SECONDS: float = 1
+    IDEMPOTENCY_KEY_TTL_SECONDS: float = 86400
+    IDEMPOTENCY_CACHE_MAX_SIZE: int = 10000
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: float = 300
+    IDEMPOTENCY_CLEANUP_BATCH: int = 10000
+    PAGE_SIZE_DEFAULT: int = 100
+    PAGE_SIZE_MAX: int = 1000
+    LOG_DIR: str = '.'
+    LOG_REQUEST_SAMPLE_RATE: float = 1.0  # share of successful requests written to the log
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ''  # bearer token required by /metrics, empty leaves it open
+    FAST_JSON_RESPONSES: bool = False  # serialize list responses without validating the rows
+    DB_STATEMENTS_WARN_PER_REQUEST: int = 20  # 0 turns the warning off
 
     @property
     def async_database_url(self):
         return (f'postgresql+asyncpg://'
                 f'{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}')
 
+    @property
+    def database_dsn(self):
+        # Plain asyncpg connections, e.g. the LISTEN connection of the stock events.
+        return self.async_database_url.replace('postgresql+asyncpg://', 'postgresql://', 1)
+
+    @property
+    def async_database_url_replica(self):
+        if self.DB_HOST_REPLICA is None:
+            return None
+        return (f'postgresql+asyncpg://'
+                f'{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST_REPLICA}:'
+                f'{self.DB_PORT_REPLICA or self.DB_PORT}/{self.DB_NAME}')
+
     @property
     def async_database_url_test(self):
         return (f'postgresql+asyncpg://'
@@ -1,11 +1,84 @@
+import time
 from typing import AsyncGenerator
 
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, \
+    AsyncEngine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from src.config import settings
+from src.metrics import Histogram, registry, request_stats
+
+DB_STATEMENT_SECONDS = registry.histogram(
+    'db_statement_duration_seconds', 'Time of one SQL statement.', ('engine',)
+)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_time = Histogram()
+        self.timeouts = 0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_time.observe(time.perf_counter() - start)
+
+
+def create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            'prepared_statement_cache_size': settings.DB_PREPARED_STATEMENT_CACHE_SIZE
+        },
+    )
+
+
+def instrument_engine(engine: AsyncEngine, name: str):
+    """
+    Time every statement of `engine` and add it to the stats of the current request.
+    """
+    statement_seconds = DB_STATEMENT_SECONDS.labels(name)
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.statement_start = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.statement_start
+        statement_seconds.observe(elapsed)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_time += elapsed
+
 
 URL_DB = settings.async_database_url
-async_engine = create_async_engine(URL_DB, echo=True)
+URL_DB_REPLICA = settings.async_database_url_replica
+async_engine = create_engine(URL_DB)
+async_engine_read = create_engine(URL_DB_REPLICA) if URL_DB_REPLICA else async_engine
+instrument_engine(async_engine, 'primary')
+if async_engine_read is not async_engine:
+    instrument_engine(async_engine_read, 'replica')
 
 
 class Base(DeclarativeBase):
@@ -13,8 +86,63 @@ class Base(DeclarativeBase):
 
 
 async_session = async_sessionmaker(async_engine, expire_on_commit=True)
+async_session_read = async_sessionmaker(async_engine_read, expire_on_commit=True)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
+
+
+async def get_async_session_read() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session on the read replica, or on the primary when no replica is configured.
+
+    Only for reads that may lag behind the primary: anything that writes, or reads what
+    the same request or user has just written, must use `get_async_session`.
+    """
+    async with async_session_read() as session:
+        yield session
+
+
+def get_async_sessionmaker_read() -> async_sessionmaker:
+    """
+    The read session factory itself, for responses that outlive the request scoped session.
+    """
+    return async_session_read
+
+
+def _pool_stats(pool: TimedQueuePool) -> dict:
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'timeouts': pool.timeouts,
+        'wait_seconds': pool.wait_time.snapshot(),
+    }
+
+
+def pool_stats() -> dict:
+    stats = {'primary': _pool_stats(async_engine.pool)}
+    if async_engine_read is not async_engine:
+        stats['replica'] = _pool_stats(async_engine_read.pool)
+    return stats
+
+
+@registry.collector
+def collect_pool_metrics():
+    pools = pool_stats()
+    for name, kind, key, documentation in (
+            ('db_pool_size', 'gauge', 'size', 'Connections the pool keeps open.'),
+            ('db_pool_checked_out', 'gauge', 'checked_out', 'Connections in use.'),
+            ('db_pool_overflow', 'gauge', 'overflow', 'Connections above the pool size.'),
+            ('db_pool_timeouts_total', 'counter', 'timeouts',
+             'Checkouts that gave up waiting for a connection.'),
+            ('db_pool_wait_seconds', 'histogram', 'wait_seconds',
+             'Time a checkout waited for a connection.'),
+    ):
+        yield name, kind, documentation, [
+            ({'engine': engine}, stats[key]) for engine, stats in pools.items()
+        ]
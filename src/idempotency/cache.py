@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from src.config import settings
+from src.metrics import registry
+
+# Larger responses, e.g. of big intakes, are only kept in the table.
+MAX_CACHED_BODY_BYTES = 65536
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: bytes
+    status_code: int
+    body: bytes
+
+
+class IdempotencyCache:
+    """
+    In-process TTL + LRU cache of stored responses in front of the idempotency_keys table.
+
+    A response is cached only after the transaction that stored it committed, so a cached
+    key always exists in the table.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._responses: OrderedDict[bytes, tuple[float, StoredResponse]] = OrderedDict()
+
+    def get(self, key: bytes) -> StoredResponse | None:
+        entry = self._responses.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._responses[key]
+            self.misses += 1
+            return None
+        self._responses.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: bytes, response: StoredResponse, ttl: float | None = None):
+        if len(response.body) > MAX_CACHED_BODY_BYTES:
+            return
+        self._responses[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), response)
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.max_size:
+            self._responses.popitem(last=False)
+
+    def clear(self):
+        self._responses.clear()
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._responses),
+            'max_size': self.max_size,
+        }
+
+
+idempotency_cache = IdempotencyCache(
+    settings.IDEMPOTENCY_CACHE_MAX_SIZE, settings.IDEMPOTENCY_KEY_TTL_SECONDS
+)
+
+
+@registry.collector
+def collect_idempotency_cache_metrics():
+    stats = idempotency_cache.stats()
+    yield 'idempotency_cache_hits_total', 'counter', 'Replays answered from memory.', [
+        ({}, stats['hits'])
+    ]
+    yield 'idempotency_cache_misses_total', 'counter', 'Keys looked up in the table.', [
+        ({}, stats['misses'])
+    ]
+    yield 'idempotency_cache_size', 'gauge', 'Responses held in memory.', [
+        ({}, stats['size'])
+    ]
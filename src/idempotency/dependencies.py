@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Annotated
+
+from fastapi import Depends, Header, HTTPException, Request, Response
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.auth.auth import get_current_user
+from src.auth.models import User
+from src.auth.schemas import TokenData
+from src.config import settings
+from src.idempotency.cache import StoredResponse, idempotency_cache
+from src.idempotency.models import IdempotencyKey
+from src.logger_error import logger
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _ttl() -> timedelta:
+    return timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+
+
+class IdempotentRequest:
+    """
+    A write request sent with an `Idempotency-Key` header.
+
+    The endpoint first calls `replay`, which answers a repeated request with the stored
+    response. Otherwise it stores its response with `save` in the transaction of the write,
+    so the write and its response are committed together, and calls `remember` after the
+    commit. When a concurrent request with the same key committed first, `save` returns
+    False and the endpoint rolls back and replays it with `replay_concurrent` instead.
+    """
+
+    def __init__(self, key: bytes, fingerprint: bytes):
+        self.key = key
+        self.fingerprint = fingerprint
+        self._stored: StoredResponse | None = None
+
+    def fingerprint_content(self, content: bytes):
+        """
+        Fingerprint an uploaded file instead of the request body, the multipart boundary
+        of the body changes between retries of the same upload.
+        """
+        self.fingerprint = _digest(content)
+
+    def _response(self, stored: StoredResponse) -> Response:
+        if stored.fingerprint != self.fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail=f'{IDEMPOTENCY_KEY_HEADER} was already used for another request'
+            )
+        return Response(
+            content=stored.body, status_code=stored.status_code, media_type='application/json',
+            headers={REPLAYED_HEADER: 'true'}
+        )
+
+    async def replay(self, db: AsyncSession) -> Response | None:
+        """
+        Stored response of this key, None if the key was not used yet.
+        """
+        stored = idempotency_cache.get(self.key)
+        if stored is None:
+            row = (await db.execute(
+                select(
+                    IdempotencyKey.fingerprint, IdempotencyKey.status_code,
+                    IdempotencyKey.body, IdempotencyKey.created_at
+                ).filter(
+                    IdempotencyKey.key == self.key,
+                    IdempotencyKey.created_at > func.now() - _ttl()
+                )
+            )).first()
+            if row is None:
+                return None
+            stored = StoredResponse(row.fingerprint, row.status_code, row.body)
+            age = datetime.now(timezone.utc) - row.created_at
+            idempotency_cache.set(self.key, stored, (_ttl() - age).total_seconds())
+        return self._response(stored)
+
+    async def replay_concurrent(self, db: AsyncSession) -> Response:
+        """
+        Stored response of the concurrent request that saved this key first, after `save`
+        returned False. Raises 409 if there is none to replay, e.g. its key expired meanwhile.
+        """
+        replay = await self.replay(db)
+        if replay is None:
+            raise HTTPException(
+                status_code=409,
+                detail=f'A request with this {IDEMPOTENCY_KEY_HEADER} is in progress'
+            )
+        return replay
+
+    async def save(self, db: AsyncSession, body: bytes, status_code: int = 200) -> bool:
+        """
+        Store the response in the current transaction, False if another request with the
+        same key committed first. An expired row of the key is overwritten.
+        """
+        stored = StoredResponse(self.fingerprint, status_code, body)
+        key = insert(IdempotencyKey).values(
+            key=self.key, fingerprint=stored.fingerprint, status_code=stored.status_code,
+            body=stored.body
+        )
+        key = key.on_conflict_do_update(
+            index_elements=['key'],
+            set_={
+                'fingerprint': key.excluded.fingerprint,
+                'status_code': key.excluded.status_code,
+                'body': key.excluded.body,
+                'created_at': func.now(),
+            },
+            where=IdempotencyKey.created_at <= func.now() - _ttl()
+        ).returning(IdempotencyKey.key)
+        if (await db.execute(key)).first() is None:
+            return False
+        self._stored = stored
+        return True
+
+    def remember(self):
+        if self._stored is not None:
+            idempotency_cache.set(self.key, self._stored)
+
+
+async def idempotent_request(
+        request: Request,
+        current_user: Annotated[User | TokenData, Depends(get_current_user)],
+        key: Annotated[str | None, Header(
+            alias=IDEMPOTENCY_KEY_HEADER, min_length=1, max_length=255,
+            description='Unique key of the request, a retry with the same key returns the '
+                        'stored response instead of repeating the write'
+        )] = None
+) -> IdempotentRequest | None:
+    """
+    The request if it was sent with an `Idempotency-Key`. Keys are scoped to the path and
+    the user, the body is fingerprinted so a key can not be reused for another request.
+    """
+    if key is None:
+        return None
+    # A multipart body is read by the form parser and its boundary changes between retries,
+    # such endpoints fingerprint their upload with `fingerprint_content`.
+    body = b'' if request.headers.get('content-type', '').startswith('multipart/') \
+        else await request.body()
+    return IdempotentRequest(
+        _digest(f'{request.url.path}\0{current_user.email}\0{key}'.encode()), _digest(body)
+    )
+
+
+async def delete_expired_keys(db: AsyncSession, limit: int) -> int:
+    """
+    Delete up to `limit` expired keys through the created_at index, returns how many.
+    """
+    expired = select(IdempotencyKey.key).filter(
+        IdempotencyKey.created_at <= func.now() - _ttl()
+    ).limit(limit).scalar_subquery()
+    result = await db.execute(delete(IdempotencyKey).filter(IdempotencyKey.key.in_(expired)))
+    return result.rowcount
+
+
+async def run_cleanup(session_factory: async_sessionmaker):
+    """
+    Delete expired keys in batches of IDEMPOTENCY_CLEANUP_BATCH, a short transaction each.
+    """
+    while True:
+        try:
+            deleted = settings.IDEMPOTENCY_CLEANUP_BATCH
+            while deleted == settings.IDEMPOTENCY_CLEANUP_BATCH:
+                async with session_factory() as db:
+                    deleted = await delete_expired_keys(db, settings.IDEMPOTENCY_CLEANUP_BATCH)
+                    await db.commit()
+        except Exception as error:
+            logger.error(error)
+        await asyncio.sleep(settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS)
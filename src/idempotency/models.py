@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, LargeBinary, SmallInteger, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import Base
+
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+
+    # blake2b digests of (path, user, Idempotency-Key) and of the request body.
+    key: Mapped[bytes] = mapped_column(LargeBinary(16), primary_key=True)
+    fingerprint: Mapped[bytes] = mapped_column(LargeBinary(16), nullable=False)
+    status_code: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), index=True, nullable=False
+    )
+
+    def __str__(self):
+        return (f'{self.__class__.__name__}(key={self.key.hex()}, '
+                f'status_code={self.status_code}, created_at={self.created_at})')
+
+    def __repr__(self):
+        return str(self)
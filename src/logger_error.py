@@ -1,9 +1,6 @@
 import logging
 
+from src.logger_queue import queue_logger
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.ERROR)
-handler = logging.FileHandler('src.log', encoding='utf=8', mode='w')
-formater = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formater)
-logger.addHandler(handler)
+
+logger = queue_logger(__name__, 'src.log', logging.ERROR)
@@ -0,0 +1,48 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+from src.config import settings
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the `fields` passed in `extra` merged in.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def queue_logger(name: str, filename: str, level: int) -> logging.Logger:
+    """
+    Logger that only puts records on a queue, a listener thread writes them to a file.
+
+    Every worker process appends to its own `<name>.<pid>.log`, so the gunicorn workers
+    neither truncate nor interleave each other's files.
+    """
+    stem, extension = os.path.splitext(filename)
+    path = os.path.join(settings.LOG_DIR, f'{stem}.{os.getpid()}{extension}')
+    handler = logging.FileHandler(path, encoding='utf-8', mode='a', delay=True)
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.listener = listener
+    logger.addHandler(queue_handler)
+    return logger
@@ -1,9 +1,6 @@
 import logging
 
+from src.logger_queue import queue_logger
 
-logger_request = logging.getLogger(__name__)
-logger_request.setLevel(logging.INFO)
-handler = logging.FileHandler('app_requests.log', encoding='utf=8', mode='w')
-formater = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formater)
-logger_request.addHandler(handler)
+
+logger_request = queue_logger(__name__, 'app_requests.log', logging.INFO)
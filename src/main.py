@@ -1,16 +1,25 @@
+import asyncio
+import secrets
 from contextlib import asynccontextmanager
+from typing import Annotated
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 from sqlalchemy.exc import IntegrityError
 
 from src.auth.auth import get_password_hash
+from src.auth.hashing import password_hasher
 from src.auth.dependencies import get_admin
 from src.auth.models import User
 from src.auth.router import router as router_auth
 from src.clothing.router import router as router_clothing
+from src.clothing.events import stock_events
+from src.clothing.snapshot import stock_snapshot
 from src.config import settings
-from src.database import async_session
-from src.logger_request import logger_request
+from src.database import async_session, async_session_read
+from src.idempotency.dependencies import run_cleanup
+from src.metrics import registry
+from src.middleware import AccessLogMiddleware, MetricsMiddleware
 from src.admin.router import router as router_admin
 from src.order.router import router as router_order
 
@@ -22,12 +31,13 @@ Clothing Orders API welcomes you.
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Create admin user in database.
+    Create admin user in database, start the stock snapshot, the stock events and the
+    cleanup of expired idempotency keys.
     """
     async with async_session() as session:
         admin = await get_admin(session)
         if not admin:
-            hashed_password = get_password_hash(settings.PASSWORD_ADMIN)
+            hashed_password = await get_password_hash(settings.PASSWORD_ADMIN)
             user = User(
                 name=settings.NAME_ADMIN,
                 surname=settings.SURNAME_ADMIN,
@@ -46,14 +56,28 @@ async def lifespan(app: FastAPI):
                 print("Admin user already exists, skipping creation")
         else:
             print("Admin user already exists, skipping creation")
+    if settings.STOCK_SNAPSHOT_ENABLED:
+        stock_snapshot.start(async_session_read)
+    if settings.STOCK_EVENTS_ENABLED:
+        stock_events.start(settings.database_dsn)
+    idempotency_cleanup = asyncio.create_task(run_cleanup(async_session))
     yield
+    idempotency_cleanup.cancel()
+    try:
+        await idempotency_cleanup
+    except asyncio.CancelledError:
+        pass
+    await stock_events.stop()
+    await stock_snapshot.stop()
+    password_hasher.shutdown()
 
 
 app = FastAPI(
     title='Clothing Orders',
     description=DESCRIPTION,
     version='0.0.1',
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if settings.FAST_JSON_RESPONSES else JSONResponse
 )
 
 
@@ -63,16 +87,25 @@ app.include_router(router_clothing)
 app.include_router(router_order)
 
 
-@app.middleware('http')
-async def dispatch(request: Request, call_next):
-    try:
-        name = request.url.path
-        method = request.method
-        url = request.url
-        ip = request.client.host
-        logger_request.info(f'Request from {name}: {method} - {url} ip - {ip}')
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        logger_request.error(f'Middleware error: {e}')
-        raise
+app.add_middleware(AccessLogMiddleware)
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get('/metrics', include_in_schema=False)
+    async def metrics(authorization: Annotated[str | None, Header()] = None):
+        """
+        Metrics of this worker in the Prometheus text format, behind a bearer token when
+        METRICS_TOKEN is set.
+        """
+        if settings.METRICS_TOKEN and not secrets.compare_digest(
+                (authorization or '').encode(), f'Bearer {settings.METRICS_TOKEN}'.encode()
+        ):
+            raise HTTPException(
+                status_code=401,
+                detail='Invalid metrics token',
+                headers={'WWW-Authenticate': 'Bearer'}
+            )
+        return PlainTextResponse(
+            registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8'
+        )
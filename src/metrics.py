@@ -0,0 +1,196 @@
+import bisect
+import math
+import threading
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """
+    Cumulative histogram of observations in seconds, with Prometheus style `le` buckets.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = {}
+        running = 0
+        for bucket, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative['+Inf' if bucket == float('inf') else format(bucket, 'g')] = running
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+
+class MetricFamily:
+    """
+    Metrics of one name, one child per combination of label values.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 labelnames: tuple[str, ...] = (), factory: Callable = Counter):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: dict[tuple[str, ...], Counter | Gauge | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> Counter | Gauge | Histogram:
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {key}')
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def samples(self) -> Iterable[tuple[dict[str, str], float | dict]]:
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            yield labels, child.snapshot() if isinstance(child, Histogram) else child.value
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+def render_family(name: str, kind: str, documentation: str,
+                  samples: Iterable[tuple[dict[str, str], float | dict]]) -> list[str]:
+    """
+    Samples of one metric in the Prometheus text exposition format, a histogram sample
+    is a `Histogram.snapshot()`.
+    """
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        if kind == 'histogram':
+            for bucket, count in value['buckets'].items():
+                lines.append(f'{name}_bucket{_format_labels({**labels, "le": bucket})} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+        else:
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return lines
+
+
+class Registry:
+    """
+    Metrics of this worker process, rendered for `/metrics`.
+
+    Collectors are called on every render and return `(name, kind, documentation,
+    samples)` tuples, for values that already live elsewhere such as cache statistics.
+    """
+
+    def __init__(self):
+        self._families: dict[str, MetricFamily] = {}
+        self._collectors: list[Callable[[], Iterable[tuple]]] = []
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        if family.name in self._families:
+            raise ValueError(f'Metric {family.name} is already registered')
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str,
+                labelnames: tuple[str, ...] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, 'counter', labelnames, Counter))
+
+    def gauge(self, name: str, documentation: str,
+              labelnames: tuple[str, ...] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, 'gauge', labelnames, Gauge))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._register(MetricFamily(
+            name, documentation, 'histogram', labelnames, lambda: Histogram(buckets)
+        ))
+
+    def collector(self, collect: Callable[[], Iterable[tuple]]) -> Callable:
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.extend(render_family(
+                family.name, family.kind, family.documentation, family.samples()
+            ))
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.extend(render_family(name, kind, documentation, samples))
+        return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """
+    SQL statements executed while handling the current request.
+    """
+    __slots__ = ('statements', 'db_time')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+registry = Registry()
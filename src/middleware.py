@@ -0,0 +1,125 @@
+import random
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import settings
+from src.logger_request import logger_request
+from src.metrics import COUNT_BUCKETS, RequestStats, registry, request_stats
+
+HTTP_REQUESTS = registry.counter(
+    'http_requests_total', 'Requests handled.', ('method', 'route', 'status')
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Time to handle a request.', ('method', 'route')
+)
+HTTP_REQUESTS_IN_PROGRESS = registry.gauge(
+    'http_requests_in_progress', 'Requests being handled.'
+)
+HTTP_REQUEST_DB_STATEMENTS = registry.histogram(
+    'http_request_db_statements', 'SQL statements per request.', ('route',), COUNT_BUCKETS
+)
+HTTP_REQUEST_DB_SECONDS = registry.histogram(
+    'http_request_db_duration_seconds', 'Time in SQL statements per request.', ('route',)
+)
+
+
+def route_path(scope: Scope) -> str:
+    """
+    Path template of the matched route, e.g. `/clothing/{name}/sizes/`, or the raw path
+    when no route matched, so log lines of one route look the same for every parameter.
+    """
+    route = scope.get('route')
+    return getattr(route, 'path', None) or scope['path']
+
+
+class AccessLogMiddleware:
+    """
+    Pure ASGI middleware that logs method, route, status, client IP and wall time.
+
+    Unlike `BaseHTTPMiddleware` it runs the app in the same task and passes every message
+    through unchanged, so streaming responses are not buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            logger_request.error('Middleware error', extra={'fields': {
+                'method': scope['method'], 'path': route_path(scope), 'error': repr(e)
+            }})
+            raise
+        if status >= 400 or random.random() < settings.LOG_REQUEST_SAMPLE_RATE:
+            client = scope.get('client')
+            logger_request.info('Request', extra={'fields': {
+                'method': scope['method'],
+                'path': route_path(scope),
+                'query': scope.get('query_string', b'').decode('latin-1'),
+                'status': status,
+                'ip': client[0] if client else None,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            }})
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware that feeds the request metrics of `src.metrics.registry`.
+
+    Requests that match no route share the `unmatched` route label, so scanners can not
+    create a new time series per path. A request that executes more SQL statements than
+    `DB_STATEMENTS_WARN_PER_REQUEST` is logged as a warning, usually an N+1 query.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        stats = RequestStats()
+        token = request_stats.set(stats)
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.labels().inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.labels().dec()
+            request_stats.reset(token)
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            HTTP_REQUESTS.labels(scope['method'], route, status).inc()
+            HTTP_REQUEST_SECONDS.labels(scope['method'], route).observe(
+                time.perf_counter() - start
+            )
+            HTTP_REQUEST_DB_STATEMENTS.labels(route).observe(stats.statements)
+            HTTP_REQUEST_DB_SECONDS.labels(route).observe(stats.db_time)
+            if 0 < settings.DB_STATEMENTS_WARN_PER_REQUEST < stats.statements:
+                logger_request.warning('Too many SQL statements', extra={'fields': {
+                    'method': scope['method'],
+                    'path': route,
+                    'statements': stats.statements,
+                    'db_ms': round(stats.db_time * 1000, 3),
+                }})
@@ -1,32 +1,131 @@
-from datetime import date
+from typing import Sequence
 
 from pydantic import EmailStr
-from sqlalchemy import select
+from sqlalchemy import select, update, insert, exists, tuple_, any_, bindparam, func, \
+    Exists, Integer, String, Row
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.clothing.models import Clothing
+from src.auth.models import User
+from src.clothing.models import Clothing, Size
 from src.order.models import Order
 
+# First key of the advisory lock on the orders of a user, the second one is the user id.
+USER_ORDERS_LOCK = 1
 
-async def get_order(db: AsyncSession, email: EmailStr, name_clothing: str) -> Order:
-    order = select(Order).filter(
-        Order.email_user == email, Order.name_clothing == name_clothing
+
+def _ordered(email: EmailStr, clothing_id) -> Exists:
+    """
+    Whether the user already ordered a size of the clothing, through the (user_id, size_id)
+    index of orders and the primary key of sizes.
+    """
+    ordered_size = aliased(Size)
+    return exists().where(
+        Order.user_id == select(User.id).filter(User.email == email).scalar_subquery(),
+        Order.size_id == ordered_size.id,
+        ordered_size.clothing_id == clothing_id
+    )
+
+
+async def lock_user_orders(db: AsyncSession, email: EmailStr) -> None:
+    """
+    Serialize the orders of the user until the end of the transaction with an advisory
+    lock. Under READ COMMITTED the next statement then sees every order of the user
+    committed before, so concurrent requests can not order the same clothing twice.
+    """
+    lock = select(func.pg_advisory_xact_lock(USER_ORDERS_LOCK, User.id)).filter(
+        User.email == email
     )
-    ref = await db.execute(order)
-    return ref.scalars().first()
+    await db.execute(lock)
+
+
+async def get_order(db: AsyncSession, email: EmailStr, name_clothing: str) -> Row | None:
+    """
+    (id, name_user, birthdate, email_user, name_clothing, size) row of the order of the
+    clothing by the user.
+    """
+    order = select(
+        Order.id, User.name.label('name_user'), User.birthdate, User.email.label('email_user'),
+        Clothing.name.label('name_clothing'), Size.size
+    ).join(User, User.id == Order.user_id).join(Size, Size.id == Order.size_id).join(
+        Clothing, Clothing.id == Size.clothing_id
+    ).filter(User.email == email, Clothing.name == name_clothing)
+    result = await db.execute(order)
+    return result.first()
+
 
+async def reserve_size_and_add_order(
+        db: AsyncSession, email: EmailStr, name_clothing: str, size: str
+) -> Row | None:
+    """
+    Decrement the stock of the size and insert the order in a single statement.
 
-async def add_order(
-        db: AsyncSession, name: str, birthdate: date, email: EmailStr,
-        name_clothing: str, size: str
-) -> Order:
-    order = Order(name_user=name, birthdate=birthdate,
-                  email_user=email, name_clothing=name_clothing, size=size)
-    db.add(order)
-    return order
+    The decrement is conditional on `quantity > 0` and on the user not having ordered
+    this clothing yet, so concurrent orders can never oversell a size. Returns the
+    (id, quantity) row of the new order and the quantity left, or None if nothing was
+    reserved.
+    """
+    reserved = update(Size).where(
+        Size.clothing_id == Clothing.id,
+        Clothing.name == name_clothing,
+        Size.size == size,
+        Size.quantity > 0,
+        exists().where(User.email == email),
+        ~_ordered(email, Clothing.id)
+    ).values(quantity=Size.quantity - 1).returning(Size.id, Size.quantity).cte('reserved')
+    order = insert(Order).add_cte(reserved).from_select(
+        ['user_id', 'size_id'],
+        select(User.id, reserved.c.id).select_from(reserved).join(User, User.email == email)
+    ).returning(Order.id, select(reserved.c.quantity).scalar_subquery().label('quantity'))
+    result = await db.execute(order)
+    return result.first()
 
 
-async def update_quantity_size(db: AsyncSession, clothing_size: Clothing, size: str):
-    quantity_size = next(s for s in clothing_size.sizes if s.size == size)
-    quantity_size.quantity -= 1
-    db.add(quantity_size)
+async def lock_cart_sizes(
+        db: AsyncSession, email: EmailStr, items: list[tuple[str, str]]
+) -> Sequence[Row]:
+    """
+    Lock the sizes of the (name, size) items with SELECT ... FOR UPDATE, in the
+    (clothing_id, size) order of `upsert_stock`, so concurrent carts and intakes never
+    deadlock.
+
+    Returns (id, name, size, quantity, ordered) rows of the sizes that exist, `ordered`
+    tells whether the user already has an order for the clothing.
+    """
+    sizes = select(
+        Size.id, Clothing.name, Size.size, Size.quantity,
+        _ordered(email, Clothing.id).label('ordered')
+    ).join(Clothing, Clothing.id == Size.clothing_id).filter(
+        tuple_(Clothing.name, Size.size).in_(items)
+    ).order_by(Size.clothing_id, Size.size).with_for_update(of=Size)
+    result = await db.execute(sizes)
+    return result.all()
+
+
+async def reserve_cart(db: AsyncSession, email: EmailStr, size_ids: list[int]) -> Sequence[Row]:
+    """
+    Decrement the stock of the locked sizes and insert one order per size in a single
+    statement. Returns (id, size_id) rows of the new orders, a size the user can not order
+    anymore gets none.
+    """
+    reserved = update(Size).where(
+        Size.id == any_(bindparam('size_ids', size_ids, type_=ARRAY(Integer))),
+        Size.quantity > 0,
+        exists().where(User.email == email),
+        ~_ordered(email, Size.clothing_id)
+    ).values(quantity=Size.quantity - 1).returning(Size.id).cte('reserved')
+    orders = insert(Order).add_cte(reserved).from_select(
+        ['user_id', 'size_id'],
+        select(User.id, reserved.c.id).select_from(reserved).join(User, User.email == email)
+    ).returning(Order.id, Order.size_id)
+    result = await db.execute(orders)
+    return result.all()
+
+
+async def get_clothing_names(db: AsyncSession, names: list[str]) -> set[str]:
+    clothing = select(Clothing.name).filter(
+        Clothing.name == any_(bindparam('names', names, type_=ARRAY(String)))
+    )
+    result = await db.execute(clothing)
+    return set(result.scalars())
@@ -1,5 +1,4 @@
-from datetime import date
-
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from src.database import Base
@@ -7,18 +6,20 @@ from src.database import Base
 
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Orders of a user, and whether the user already ordered a size, in one index.
+        Index('ix_orders_user_id_size_id', 'user_id', 'size_id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    name_user: Mapped[str] = mapped_column(nullable=False)
-    birthdate: Mapped[date] = mapped_column(nullable=False)
-    email_user: Mapped[str] = mapped_column(index=True, nullable=False)
-    name_clothing: Mapped[str] = mapped_column(index=True, nullable=False)
-    size: Mapped[str] = mapped_column(nullable=False)
+    # Orders are history: they stay when their user or clothing is deleted, without it.
+    user_id: Mapped[int | None] = mapped_column(ForeignKey('users.id', ondelete='SET NULL'))
+    size_id: Mapped[int | None] = mapped_column(ForeignKey('sizes.id', ondelete='SET NULL'),
+                                                index=True)
 
     def __str__(self):
-        return (f'{self.__class__.__name__}(id={self.id}, name_user={self.name_user}, '
-                f'birthdate={self.birthdate}, email_user={self.email_user}, '
-                f'name_clothing={self.name_clothing}, size={self.size})')
+        return (f'{self.__class__.__name__}(id={self.id}, user_id={self.user_id}, '
+                f'size_id={self.size_id})')
 
     def __repr__(self):
         return str(self)
@@ -6,11 +6,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.auth import get_current_user
 from src.auth.models import User
-from src.clothing.dependencies import get_clothing_and_size
+from src.clothing.cache import catalog_cache
+from src.clothing.dependencies import get_available_sizes
+from src.clothing.events import StockChange, publish_stock_changes
+from src.clothing.snapshot import stock_snapshot, SnapshotUnavailable
+from src.config import settings
 from src.database import get_async_session
+from src.idempotency.dependencies import IdempotentRequest, idempotent_request
 from src.logger_error import logger
-from src.order.dependencies import get_order, add_order, update_quantity_size
-from src.order.schemas import CreateOrder
+from src.order.dependencies import reserve_size_and_add_order, lock_cart_sizes, reserve_cart, \
+    get_clothing_names, lock_user_orders
+from src.order.schemas import CreateOrder, CreateCart, CartLine, cart_lines_adapter
 
 router = APIRouter(
     prefix='/orders',
@@ -22,7 +28,8 @@ router = APIRouter(
 async def create_order_for_user(
         db: Annotated[AsyncSession, Depends(get_async_session)],
         current_user: Annotated[User, Depends(get_current_user)],
-        create_order: CreateOrder
+        create_order: CreateOrder,
+        idempotency: Annotated[IdempotentRequest | None, Depends(idempotent_request)]
 ):
     """
     Add orders for get a clothing.
@@ -30,34 +37,169 @@ async def create_order_for_user(
         Params:
             name (string): Name clothing.
             size (string): Size clothing.
+            Idempotency-Key (header): Optional, a retry with the same key returns the order
+                instead of ordering again.
 
         Returns:
             Order for user.
     """
     try:
-        clothing_sizes = await get_clothing_and_size(db, create_order.name)
-        if not clothing_sizes:
+        if idempotency is not None and (replay := await idempotency.replay(db)):
+            return replay
+        sizes, hinted = None, False
+        if settings.STOCK_SNAPSHOT_ENABLED:
+            # Only a hint for the error of a rejected order, the snapshot lags the stock by
+            # up to one refresh. The reserve query decides whether the order is placed.
+            try:
+                sizes, hinted = stock_snapshot.sizes(create_order.name), True
+            except SnapshotUnavailable:
+                pass
+        await lock_user_orders(db, current_user.email)
+        order = await reserve_size_and_add_order(
+            db, current_user.email, create_order.name, create_order.size
+        )
+        if order is None:
+            # A concurrent request with the same key may have ordered it meanwhile.
+            if idempotency is not None and (replay := await idempotency.replay(db)):
+                return replay
+            if not hinted or sizes is not None and create_order.size in {o.size for o in sizes}:
+                sizes = await get_available_sizes(db, create_order.name)
+            if sizes is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f'Clothing with name {create_order.name} not found'
+                )
+            if create_order.size not in {o.size for o in sizes}:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f'The {create_order.name} size {create_order.size} are out of '
+                           f'stock'
+                )
             raise HTTPException(
-                status_code=404,
-                detail=f'Clothing with name {create_order.name} not found'
+                status_code=409,
+                detail=f'You have already ordered {create_order.name}'
+            )
+        await publish_stock_changes(
+            db, [StockChange(create_order.name, create_order.size, order.quantity)]
+        )
+        if idempotency is not None and not await idempotency.save(
+                db, create_order.model_dump_json().encode()
+        ):
+            await db.rollback()
+            return await idempotency.replay_concurrent(db)
+        await db.commit()
+        catalog_cache.invalidate([('sizes', create_order.name)])
+        if idempotency is not None:
+            idempotency.remember()
+        return create_order
+    except IntegrityError as error:
+        logger.error(error)
+        raise HTTPException(
+            status_code=503,
+            detail=f'Database error: {error}'
+        )
+    except HTTPException as error:
+        logger.error(error)
+        raise error
+    except Exception as error:
+        logger.error(error)
+        raise HTTPException(
+            status_code=500,
+            detail=f'Server error: {error}'
+        )
+
+
+def _check_cart(cart: CreateCart, locked: dict, known_names: set[str] | None) -> list[CartLine]:
+    lines = []
+    names = set()
+    for number, item in enumerate(cart.items, start=1):
+        size = locked.get((item.name, item.size))
+        detail = None
+        if size is None and known_names is not None and item.name not in known_names:
+            detail = f'Clothing with name {item.name} not found'
+        elif size is None or size.quantity <= 0:
+            detail = f'The {item.name} size {item.size} are out of stock'
+        elif size.ordered or item.name in names:
+            detail = f'You have already ordered {item.name}'
+        names.add(item.name)
+        lines.append(CartLine(
+            line=number, name=item.name, size=item.size,
+            status='error' if detail else 'ordered', detail=detail
+        ))
+    return lines
+
+
+@router.post('/cart/', response_model=list[CartLine])
+async def create_cart_order_for_user(
+        db: Annotated[AsyncSession, Depends(get_async_session)],
+        current_user: Annotated[User, Depends(get_current_user)],
+        cart: CreateCart,
+        idempotency: Annotated[IdempotentRequest | None, Depends(idempotent_request)]
+):
+    """
+    Order every item of a cart in one transaction, or none of them.
+
+        Params:
+            items (list): Up to 20 items with name and size, one item per clothing.
+            Idempotency-Key (header): Optional, a retry with the same key returns the lines
+                instead of ordering again.
+
+        Returns:
+            Ordered lines, or a 409 with the lines that can not be ordered.
+    """
+    try:
+        if idempotency is not None and (replay := await idempotency.replay(db)):
+            return replay
+        await lock_user_orders(db, current_user.email)
+        locked = {
+            (size.name, size.size): size
+            for size in await lock_cart_sizes(
+                db, current_user.email, [(item.name, item.size) for item in cart.items]
             )
-        if create_order.size not in {o.size for o in clothing_sizes.sizes if o.quantity > 0}:
+        }
+        lines = _check_cart(cart, locked, None)
+        if any(line.status == 'error' for line in lines):
+            if idempotency is not None and (replay := await idempotency.replay(db)):
+                return replay
+            # Only a failed cart pays for telling unknown clothing from sold out sizes.
+            known_names = await get_clothing_names(db, list({item.name for item in cart.items}))
             raise HTTPException(
-                status_code=404,
-                detail=f'The {create_order.name} size {create_order.size} are out of '
-                       f'stock'
+                status_code=409,
+                detail=[
+                    line.model_dump() for line in _check_cart(cart, locked, known_names)
+                    if line.status == 'error'
+                ]
             )
-        order = await get_order(db, current_user.email, create_order.name)
-        if order:
+        orders = await reserve_cart(db, current_user.email, [size.id for size in locked.values()])
+        if len(orders) != len(lines):
+            # A concurrent order of another size of the clothing, or the deletion of the
+            # user, won since the sizes were locked.
+            await db.rollback()
+            reserved = {order.size_id for order in orders}
             raise HTTPException(
                 status_code=409,
-                detail=f'You have already ordered {create_order.name}'
+                detail=[
+                    line.model_dump() | {
+                        'status': 'error',
+                        'detail': f'The {line.name} size {line.size} can not be ordered'
+                    }
+                    for line in lines if locked[(line.name, line.size)].id not in reserved
+                ]
             )
-        await add_order(db, current_user.name, current_user.birthdate, current_user.email,
-                        create_order.name, create_order.size)
-        await update_quantity_size(db, clothing_sizes, create_order.size)
+        # The sizes are locked, the stock left is known without reading it again.
+        await publish_stock_changes(
+            db, [StockChange(size.name, size.size, size.quantity - 1) for size in locked.values()]
+        )
+        if idempotency is not None and not await idempotency.save(
+                db, cart_lines_adapter.dump_json(lines)
+        ):
+            await db.rollback()
+            return await idempotency.replay_concurrent(db)
         await db.commit()
-        return create_order
+        catalog_cache.invalidate({('sizes', size.name) for size in locked.values()})
+        if idempotency is not None:
+            idempotency.remember()
+        return lines
     except IntegrityError as error:
         logger.error(error)
         raise HTTPException(
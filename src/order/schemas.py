@@ -1,10 +1,13 @@
 import re
+from typing import Literal
 
 from fastapi import HTTPException
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 
 letters = re.compile(r'^[а-яА-Яa-zA-Z\-]+$')
 
+MAX_CART_ITEMS = 20
+
 
 class CreateOrder(BaseModel):
     name: str = Field(min_length=3, max_length=20, description='Name clothing should '
@@ -31,3 +34,18 @@ class CreateOrder(BaseModel):
             status_code=400,
             detail=f'Size should be in: {sizes}'
         )
+
+
+class CreateCart(BaseModel):
+    items: list[CreateOrder] = Field(min_length=1, max_length=MAX_CART_ITEMS)
+
+
+class CartLine(BaseModel):
+    line: int
+    name: str
+    size: str
+    status: Literal['ordered', 'error']
+    detail: str | None = None
+
+
+cart_lines_adapter = TypeAdapter(list[CartLine])
@@ -0,0 +1,53 @@
+import base64
+import binascii
+from typing import Annotated, NamedTuple, Sequence
+
+from fastapi import HTTPException, Query
+
+from src.config import settings
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class PageParams(NamedTuple):
+    limit: int
+    after_id: int | None
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(f'id:{last_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        prefix, last_id = raw.split(':')
+        if prefix != 'id':
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=400,
+            detail='Invalid cursor'
+        )
+
+
+def page_params(
+        limit: Annotated[int, Query(
+            ge=1, le=settings.PAGE_SIZE_MAX, description='Maximum number of items on the page'
+        )] = settings.PAGE_SIZE_DEFAULT,
+        cursor: Annotated[str | None, Query(
+            description=f'Cursor of the next page, returned in the {NEXT_CURSOR_HEADER} header'
+        )] = None
+) -> PageParams:
+    return PageParams(limit, decode_cursor(cursor) if cursor else None)
+
+
+def split_page(rows: Sequence, page: PageParams) -> tuple[Sequence, str | None]:
+    """
+    Rows fetched with `limit + 1` to the rows of the page and the cursor of the next page.
+    """
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    return rows, encode_cursor(rows[-1].id)
@@ -0,0 +1,25 @@
+from typing import Iterable
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+
+class RowSerializer:
+    """
+    Serializes rows or ORM objects straight to the JSON of a list of `model`.
+
+    Nothing is validated: only use it for rows read from the database whose attributes
+    already have the types of the model fields. For such rows the bytes are the same as
+    FastAPI produces through `response_model`, without validating every row again.
+    """
+
+    def __init__(self, model: type[BaseModel]):
+        self.fields = tuple(model.model_fields)
+
+    def dumps(self, rows: Iterable) -> bytes:
+        fields = self.fields
+        return orjson.dumps([{field: getattr(row, field) for field in fields} for row in rows])
+
+    def response(self, rows: Iterable, headers: dict[str, str] | None = None) -> Response:
+        return Response(content=self.dumps(rows), media_type='application/json', headers=headers)
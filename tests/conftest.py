@@ -1,17 +1,25 @@
-from datetime import date
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
 from typing import AsyncGenerator
 
 import pytest
 
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event, select
 from sqlalchemy.pool import NullPool
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
-from src.auth.auth import pwd_context
+from src.auth.auth import create_access_token
+from src.auth.hashing import pwd_context
 from src.auth.models import User
+from src.clothing.cache import catalog_cache
 from src.clothing.models import Clothing, Size
+from src.clothing.snapshot import StockSnapshot
 from src.config import settings
-from src.database import Base, get_async_session
+from src.database import Base, get_async_session, get_async_session_read, instrument_engine, \
+    get_async_sessionmaker_read
 from src.main import app
 from src.order.models import Order
 
@@ -21,6 +29,7 @@ engine_test = create_async_engine(URL_TEST_DB, poolclass=NullPool)
 async_session_test = async_sessionmaker(engine_test, class_=AsyncSession, expire_on_commit=False)
 
 Base.bind = engine_test
+instrument_engine(engine_test, 'test')
 
 
 async def override_get_async_session() -> AsyncSession:
@@ -29,6 +38,8 @@ async def override_get_async_session() -> AsyncSession:
 
 
 app.dependency_overrides[get_async_session] = override_get_async_session
+app.dependency_overrides[get_async_session_read] = override_get_async_session
+app.dependency_overrides[get_async_sessionmaker_read] = lambda: async_session_test
 
 
 @pytest.fixture(autouse=True, scope='session')
@@ -40,12 +51,100 @@ async def prepare_database():
         await conn.run_sync(Base.metadata.drop_all)
 
 
+@pytest.fixture(autouse=True)
+def fresh_catalog_cache():
+    # Fixtures write to the database directly, behind the back of the catalog cache.
+    catalog_cache.bump()
+
+
+# Statements of the request being handled, and the requests of the open statement budgets.
+request_statements: ContextVar[list[str] | None] = ContextVar('request_statements', default=None)
+budget_requests: list[list[list[str]]] = []
+
+
+async def app_with_request_statements(scope, receive, send):
+    """
+    The app, recording the SQL statements of every request whether or not the metrics
+    middleware is enabled.
+    """
+    if scope['type'] != 'http':
+        await app(scope, receive, send)
+        return
+    statements = []
+    for requests in budget_requests:
+        requests.append(statements)
+    token = request_statements.set(statements)
+    try:
+        await app(scope, receive, send)
+    finally:
+        request_statements.reset(token)
+
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    statements = request_statements.get()
+    if statements is not None:
+        statements.append(statement)
+
+
+event.listen(engine_test.sync_engine, 'after_cursor_execute', record_statement)
+
+
+@contextmanager
+def statement_budget(max_statements: int):
+    """
+    Fail the test if a request made inside the block executes more than `max_statements`
+    SQL statements, listing them, or if no request was made at all.
+    """
+    requests: list[list[str]] = []
+    budget_requests.append(requests)
+    try:
+        yield
+    finally:
+        budget_requests.remove(requests)
+    if not requests:
+        pytest.fail('No request was made inside the statement budget', pytrace=False)
+    for statements in requests:
+        if len(statements) > max_statements:
+            listing = '\n'.join(
+                f'{number}. {" ".join(statement.split())}'
+                for number, statement in enumerate(statements, 1)
+            )
+            pytest.fail(
+                f'Request executed {len(statements)} SQL statements, '
+                f'budget is {max_statements}:\n{listing}',
+                pytrace=False
+            )
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    """
+    `@pytest.mark.query_budget(n)` applies `statement_budget(n)` to the whole test.
+    """
+    marker = item.get_closest_marker('query_budget')
+    if marker is None:
+        return (yield)
+    with statement_budget(*marker.args):
+        return (yield)
+
+
+@pytest.fixture
+def query_budget():
+    return statement_budget
+
+
 @pytest.fixture(scope='session')
 async def async_client() -> AsyncGenerator[AsyncClient, None]:
-    async with AsyncClient(base_url='http://test', transport=ASGITransport(app=app)) as ac:
+    transport = ASGITransport(app=app_with_request_statements)
+    async with AsyncClient(base_url='http://test', transport=transport) as ac:
         yield ac
 
 
+@pytest.fixture
+def session_factory() -> async_sessionmaker:
+    return async_session_test
+
+
 @pytest.fixture(scope='session')
 async def registered_user_fixture():
     async with async_session_test() as session:
@@ -110,13 +209,20 @@ async def authorize_admin(async_client: AsyncClient, registered_admin_fixture):
 @pytest.fixture(scope='session')
 async def add_order():
     async with async_session_test() as session:
-        new_order = Order(
-            name_user='Usertest',
+        # An explicit id leaves the users id sequence to the tests that check ids.
+        user = User(
+            id=1000,
+            name='Usertest',
+            surname='TestSurname',
             birthdate=date(2000, 1, 1),
-            email_user='usertest@mail.ru',
-            name_clothing='Shirt',
-            size='M'
+            email='usertest@mail.ru',
+            hashed_password='not-used',
         )
+        session.add(user)
+        size = (await session.execute(
+            select(Size).join(Clothing).filter(Clothing.name == 'Shirt', Size.size == 'M')
+        )).scalar_one()
+        new_order = Order(user_id=user.id, size_id=size.id)
         session.add(new_order)
         await session.commit()
         return new_order
@@ -134,3 +240,54 @@ async def add_clothing():
         session.add(new_size)
         await session.commit()
         return new_size
+
+
+@pytest.fixture(scope='session')
+async def cart_stock():
+    stock = {'Mittens': {'S': 2, 'M': 0}, 'Hoodie': {'L': 10}, 'Beanie': {'S': 1},
+             'Poncho': {'XL': 30}, 'Vest': {'XL': 30}}
+    async with async_session_test() as session:
+        clothing = [Clothing(name=name) for name in stock]
+        session.add_all(clothing)
+        await session.commit()
+        session.add_all([
+            Size(clothing_id=new_clothing.id, size=size, quantity=quantity)
+            for new_clothing in clothing
+            for size, quantity in stock[new_clothing.name].items()
+        ])
+        await session.commit()
+    return stock
+
+
+@pytest.fixture(scope='session')
+async def concurrent_buyers():
+    async with async_session_test() as session:
+        session.add_all([
+            User(
+                name='Buyer',
+                surname='TestSurname',
+                email=f'buyer{i}@mail.ru',
+                birthdate=date(2000, 1, 1),
+                hashed_password='not-used',
+            ) for i in range(200)
+        ])
+        new_clothing = Clothing(name='Jacket')
+        session.add(new_clothing)
+        await session.commit()
+        session.add(Size(clothing_id=new_clothing.id, size='L', quantity=25))
+        await session.commit()
+    return [
+        create_access_token(data={'sub': f'buyer{i}@mail.ru'}, expires_delta=timedelta(minutes=5))
+        for i in range(200)
+    ]
+
+
+@pytest.fixture
+async def stock_snapshot() -> AsyncGenerator[StockSnapshot, None]:
+    snapshot = StockSnapshot(
+        f'clothing_stock_test_{os.getpid()}', 16,
+        f'/tmp/clothing_stock_test_{os.getpid()}.lock', interval=60, max_age=60
+    )
+    assert snapshot._acquire()
+    yield snapshot
+    await snapshot.stop()
@@ -1,6 +1,15 @@
+import asyncio
+import json
+from unittest.mock import patch
 
 from fastapi.encoders import jsonable_encoder
 from httpx import AsyncClient
+from sqlalchemy import select, delete
+
+from src.clothing.events import StockChange, publish_stock_changes
+from src.clothing.models import Clothing, Size
+from src.config import settings
+from src.order.models import Order
 
 
 async def test_add_clothing_size(async_client: AsyncClient, authorize_admin):
@@ -104,6 +113,34 @@ async def test_delete_clothing_by_name(async_client: AsyncClient, authorize_admi
     assert response.json()['name'] == 'Coat'
 
 
+async def test_delete_clothing_keeps_orders(
+        async_client: AsyncClient, authorize_admin, add_order, session_factory
+):
+    headers = {'Authorization': f'Bearer {authorize_admin}'}
+    await async_client.post(
+        '/admin/clothing/', headers=headers, json={'name': 'Cardigan', 'size': 'M', 'quantity': 1}
+    )
+    async with session_factory() as db:
+        size_id = (await db.execute(
+            select(Size.id).join(Clothing).filter(Clothing.name == 'Cardigan')
+        )).scalar_one()
+        order = Order(user_id=1000, size_id=size_id)
+        db.add(order)
+        await db.commit()
+
+    response = await async_client.delete('/admin/clothing/?name=Cardigan', headers=headers)
+
+    assert response.status_code == 200
+    orders = await async_client.get('/admin/orders/usertest@mail.ru/', headers=headers)
+    assert orders.status_code == 200
+    assert any(
+        order['name_clothing'] is None and order['size'] is None for order in orders.json()
+    )
+    async with session_factory() as db:
+        await db.execute(delete(Order).filter(Order.id == order.id))
+        await db.commit()
+
+
 async def test_delete_clothing_not_found(async_client: AsyncClient, authorize_admin):
     name = 'Boots'
     response = await async_client.delete(
@@ -133,6 +170,18 @@ async def test_get_orders_by_email(async_client: AsyncClient, authorize_admin, a
     ]
 
 
+async def test_list_responses_fast_json(async_client: AsyncClient, authorize_admin, add_order):
+    headers = {'Authorization': f'Bearer {authorize_admin}'}
+    for url in ('/admin/users/?limit=1', '/admin/orders/usertest@mail.ru/'):
+        response = await async_client.get(url, headers=headers)
+        with patch('src.admin.router.settings.FAST_JSON_RESPONSES', True):
+            fast = await async_client.get(url, headers=headers)
+
+        assert fast.status_code == 200
+        assert fast.content == response.content
+        assert fast.headers.get('X-Next-Cursor') == response.headers.get('X-Next-Cursor')
+
+
 async def test_get_orders_by_email_if_not_order(async_client: AsyncClient, authorize_admin):
     response = await async_client.get(
         '/admin/orders/user@example.com/',
@@ -173,3 +222,184 @@ async def test_delete_orders_user_if_not_order(async_client: AsyncClient, author
     assert response.json() == {
         'detail': f'The user with email address {email} does not have an order for the {name}'
     }
+
+
+async def test_get_all_user_invalid_cursor(async_client: AsyncClient, authorize_admin):
+    response = await async_client.get(
+        '/admin/users/?cursor=not-a-cursor',
+        headers={'Authorization': f'Bearer {authorize_admin}'}
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {'detail': 'Invalid cursor'}
+
+
+async def test_export_stock_csv(async_client: AsyncClient, authorize_admin):
+    response = await async_client.get(
+        '/admin/export/stock/',
+        headers={'Authorization': f'Bearer {authorize_admin}'}
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    assert response.text.splitlines()[0] == 'name,size,quantity'
+    assert 'Shirt,M,10' in response.text.splitlines()
+
+
+async def test_export_stock_ndjson(async_client: AsyncClient, authorize_admin):
+    response = await async_client.get(
+        '/admin/export/stock/?format=ndjson',
+        headers={'Authorization': f'Bearer {authorize_admin}'}
+    )
+
+    assert response.status_code == 200
+    assert {'name': 'Shirt', 'size': 'M', 'quantity': 10} in [
+        json.loads(line) for line in response.text.splitlines()
+    ]
+
+
+async def test_add_clothing_bulk(async_client: AsyncClient, authorize_admin):
+    headers = {'Authorization': f'Bearer {authorize_admin}'}
+    response = await async_client.post(
+        '/admin/clothing/bulk/',
+        headers=headers,
+        json=[
+            {'name': 'Socks', 'size': 'm', 'quantity': 5},
+            {'name': 'Socks', 'size': 'M', 'quantity': 2},
+            {'name': 'Socks', 'size': 'L', 'quantity': 1},
+            {'name': 'Socks@', 'size': 'M', 'quantity': 1},
+            {'name': 'Socks', 'size': 'XL', 'quantity': 0},
+        ]
+    )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result['status'] for result in results] == [
+        'added', 'added', 'added', 'error', 'error'
+    ]
+    assert results[0]['quantity'] == results[1]['quantity'] == 7
+    assert results[2]['quantity'] == 1
+    assert results[3]['detail'] == 'Name clothing should contain only letters'
+
+    response = await async_client.post(
+        '/admin/clothing/bulk/csv/',
+        headers=headers,
+        files={'file': ('delivery.csv', b'name,size,quantity\r\nSocks,L,4\r\n', 'text/csv')}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [{
+        'line': 1, 'name': 'Socks', 'size': 'L', 'quantity': 5, 'status': 'added',
+        'detail': None
+    }]
+
+    await async_client.delete('/admin/clothing/?name=Socks', headers=headers)
+
+
+async def test_stock_changes_published(async_client: AsyncClient, authorize_admin):
+    headers = {'Authorization': f'Bearer {authorize_admin}'}
+    with patch.object(settings, 'STOCK_EVENTS_ENABLED', True), patch(
+        'src.admin.router.publish_stock_changes', wraps=publish_stock_changes
+    ) as publish:
+        await async_client.post(
+            '/admin/clothing/bulk/', headers=headers,
+            json=[{'name': 'Gloves', 'size': 'M', 'quantity': 3}]
+        )
+        await async_client.post(
+            '/admin/clothing/', headers=headers, json={'name': 'Gloves', 'size': 'M', 'quantity': 2}
+        )
+        await async_client.delete('/admin/clothing/?name=Gloves', headers=headers)
+
+    assert [changes for (_, changes), _ in publish.call_args_list] == [
+        [StockChange('Gloves', 'M', 3)],
+        [StockChange('Gloves', 'M', 5)],
+        [StockChange('Gloves')],
+    ]
+
+
+async def test_add_clothing_size_idempotency_key(async_client: AsyncClient, authorize_admin):
+    headers = {'Authorization': f'Bearer {authorize_admin}', 'Idempotency-Key': 'intake-1'}
+    responses = await asyncio.gather(*(
+        async_client.post(
+            '/admin/clothing/', headers=headers, json={'name': 'Belt', 'size': 'M', 'quantity': 4}
+        ) for _ in range(5)
+    ))
+
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.content for response in responses}) == 1
+    assert sum('Idempotent-Replayed' in response.headers for response in responses) == 4
+    sizes = await async_client.get('/clothing/Belt/sizes/', headers=headers)
+    assert sizes.json() == [{'size': 'M', 'quantity': 4}]
+
+    other = await async_client.post(
+        '/admin/clothing/', headers=headers, json={'name': 'Belt', 'size': 'L', 'quantity': 4}
+    )
+    assert other.status_code == 422
+    assert other.json() == {'detail': 'Idempotency-Key was already used for another request'}
+
+    await async_client.delete('/admin/clothing/?name=Belt', headers=headers)
+
+
+async def test_add_clothing_bulk_csv_idempotency_key(
+        async_client: AsyncClient, authorize_admin
+):
+    headers = {'Authorization': f'Bearer {authorize_admin}', 'Idempotency-Key': 'delivery-1'}
+    delivery = b'name,size,quantity\r\nSandals,M,6\r\n'
+    # Every upload has its own multipart boundary.
+    responses = [
+        await async_client.post(
+            '/admin/clothing/bulk/csv/', headers=headers,
+            files={'file': ('delivery.csv', delivery, 'text/csv')}
+        ) for _ in range(2)
+    ]
+    other = await async_client.post(
+        '/admin/clothing/bulk/csv/', headers=headers,
+        files={'file': ('delivery.csv', b'name,size,quantity\r\nSandals,M,1\r\n', 'text/csv')}
+    )
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[1].content == responses[0].content
+    assert responses[1].headers['Idempotent-Replayed'] == 'true'
+    assert other.status_code == 422
+    sizes = await async_client.get('/clothing/Sandals/sizes/', headers=headers)
+    assert sizes.json() == [{'size': 'M', 'quantity': 6}]
+
+    await async_client.delete('/admin/clothing/?name=Sandals', headers=headers)
+
+
+async def test_add_clothing_size_updates_only_that_size(
+        async_client: AsyncClient, authorize_admin
+):
+    headers = {'Authorization': f'Bearer {authorize_admin}'}
+    await async_client.post(
+        '/admin/clothing/bulk/',
+        headers=headers,
+        json=[{'name': 'Scarf', 'size': 'M', 'quantity': 5},
+              {'name': 'Scarf', 'size': 'L', 'quantity': 1}]
+    )
+    await async_client.post(
+        '/admin/clothing/', headers=headers, json={'name': 'Scarf', 'size': 'M', 'quantity': 3}
+    )
+
+    response = await async_client.post(
+        '/admin/clothing/bulk/',
+        headers=headers,
+        json=[{'name': 'Scarf', 'size': 'L', 'quantity': 1}]
+    )
+
+    assert response.json()[0]['quantity'] == 2
+
+    await async_client.delete('/admin/clothing/?name=Scarf', headers=headers)
+
+
+async def test_get_pool_stats(async_client: AsyncClient, authorize_admin):
+    response = await async_client.get(
+        '/admin/pool/',
+        headers={'Authorization': f'Bearer {authorize_admin}'}
+    )
+
+    primary = response.json()['primary']
+
+    assert response.status_code == 200
+    assert {'size', 'checked_out', 'overflow', 'wait_seconds'} <= primary.keys()
+    assert primary['wait_seconds']['buckets']['+Inf'] == primary['wait_seconds']['count']
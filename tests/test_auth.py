@@ -1,9 +1,18 @@
+from datetime import date, timedelta
 from unittest.mock import patch
 
+import jwt
 from httpx import AsyncClient
 
 from fastapi.security import OAuth2PasswordRequestForm
 
+from src.auth.auth import create_access_token, user_claims
+from src.auth.cache import user_cache, token_versions
+from src.auth.dependencies import bump_token_version
+from src.auth.hashing import password_hasher
+from src.auth.models import User
+from src.config import settings
+
 
 async def test_register(async_client: AsyncClient):
     user = {
@@ -169,3 +178,118 @@ async def test_error_handling(async_client: AsyncClient):
 
     assert response.status_code == 404
     assert 'Not Found' in response.json().get('detail')
+
+
+async def test_current_user_is_cached(async_client: AsyncClient, authorize_user):
+    headers = {'Authorization': f'Bearer {authorize_user}'}
+    await async_client.get('/auth/users/me/', headers=headers)
+    hits = user_cache.hits
+    response = await async_client.get('/auth/users/me/', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()['email'] == 'user@mail.ru'
+    assert user_cache.hits == hits + 1
+
+
+async def test_deleted_user_is_evicted_from_cache(async_client: AsyncClient, authorize_admin):
+    user_data = {
+        'name': 'Cached',
+        'surname': 'User',
+        'birthdate': '2000-01-01',
+        'email': 'cached@mail.ru',
+        'password': 'password123'
+    }
+    await async_client.post('/auth/register/', json=user_data)
+    response = await async_client.post(
+        '/auth/token/',
+        data={'username': user_data['email'], 'password': user_data['password']}
+    )
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    response = await async_client.get('/auth/users/me/', headers=headers)
+
+    assert response.status_code == 200
+
+    response = await async_client.delete(
+        '/admin/users/?email=cached@mail.ru',
+        headers={'Authorization': f'Bearer {authorize_admin}'}
+    )
+
+    assert response.status_code == 200
+
+    response = await async_client.get('/auth/users/me/', headers=headers)
+
+    assert response.status_code == 401
+
+
+async def test_login_rejected_when_hasher_saturated(async_client: AsyncClient):
+    with patch.object(password_hasher, 'max_pending', 0):
+        response = await async_client.post(
+            '/auth/token/',
+            data={'username': 'user@mail.ru', 'password': 'testpassword'}
+        )
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+async def test_token_carries_user_claims(authorize_admin):
+    payload = jwt.decode(authorize_admin, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+
+    assert payload['sub'] == 'admin@mail.ru'
+    assert isinstance(payload['uid'], int)
+    assert payload['adm'] is True
+    assert payload['ver'] == 0
+
+
+async def test_stateless_mode_skips_user_lookup(
+        async_client: AsyncClient, authorize_user, authorize_admin
+):
+    with patch.object(settings, 'AUTH_STATELESS', True), \
+            patch('src.auth.auth.get_user_email', side_effect=AssertionError('DB lookup')):
+        response_user = await async_client.get(
+            '/clothing/', headers={'Authorization': f'Bearer {authorize_user}'}
+        )
+        response_admin = await async_client.get(
+            '/admin/users/', headers={'Authorization': f'Bearer {authorize_admin}'}
+        )
+        response_forbidden = await async_client.get(
+            '/admin/users/', headers={'Authorization': f'Bearer {authorize_user}'}
+        )
+
+    assert response_user.status_code == 200
+    assert response_admin.status_code == 200
+    assert response_forbidden.status_code == 403
+
+
+async def test_stateless_mode_rejects_revoked_token(
+        async_client: AsyncClient, session_factory
+):
+    async with session_factory() as session:
+        # An explicit id leaves the users id sequence to the tests that check ids.
+        user = User(
+            id=1001,
+            name='Revoked',
+            surname='TestSurname',
+            birthdate=date(2000, 1, 1),
+            email='revoked@mail.ru',
+            hashed_password='not-used',
+        )
+        session.add(user)
+        await session.commit()
+    headers = {
+        'Authorization': f'Bearer {create_access_token(user_claims(user), timedelta(minutes=5))}'
+    }
+    with patch.object(settings, 'AUTH_STATELESS', True):
+        token_versions.clear()
+        response_before = await async_client.get('/clothing/', headers=headers)
+        # Revoked by another worker: only the database knows about it.
+        async with session_factory() as session:
+            await bump_token_version(session, user.id)
+            await session.commit()
+        response_cached = await async_client.get('/clothing/', headers=headers)
+        token_versions.clear()
+        response_after = await async_client.get('/clothing/', headers=headers)
+
+    assert response_before.status_code == 200
+    assert response_cached.status_code == 200
+    assert response_after.status_code == 401
@@ -1,6 +1,21 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
 from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.clothing.cache import CatalogCache, catalog_cache, sizes_single_flight
+from src.clothing.events import StockChange, StockEvents, Subscription, SubscriptionOverflow, \
+    publish_stock_changes
+from src.clothing.router import _stock_event_stream
+from src.clothing.snapshot import HEADER, SnapshotUnavailable, StockSize, StockSnapshot
+from src.clothing.schemas import SizeResponse
+from src.config import settings
 
 
+@pytest.mark.query_budget(2)
 async def test_get_all_clothing(async_client: AsyncClient, authorize_user):
     response = await async_client.get(
         '/clothing/',
@@ -14,6 +29,7 @@ async def test_get_all_clothing(async_client: AsyncClient, authorize_user):
     }]
 
 
+@pytest.mark.query_budget(2)
 async def test_get_clothing_sizes_success(async_client: AsyncClient, authorize_user):
     response = await async_client.get(
         '/clothing/Shirt/sizes/',
@@ -50,3 +66,327 @@ async def test_get_clothing_sizes_no_sizes(async_client: AsyncClient, authorize_
     assert response.json() == {
         'detail': 'There are no sizes for this clothing'
     }
+
+
+async def test_get_all_clothing_not_modified(async_client: AsyncClient, authorize_user):
+    headers = {'Authorization': f'Bearer {authorize_user}'}
+    response = await async_client.get('/clothing/', headers=headers)
+    etag = response.headers['ETag']
+
+    with patch('src.clothing.router.get_clothing_all', side_effect=AssertionError('DB query')):
+        response = await async_client.get(
+            '/clothing/', headers={**headers, 'If-None-Match': etag}
+        )
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.content == b''
+
+
+async def test_get_clothing_sizes_cache_invalidated_by_admin(
+        async_client: AsyncClient, authorize_user, authorize_admin
+):
+    headers = {'Authorization': f'Bearer {authorize_user}'}
+    response = await async_client.get('/clothing/Shirt/sizes/', headers=headers)
+    etag = response.headers['ETag']
+    await async_client.post(
+        '/admin/clothing/',
+        json={'name': 'Shirt', 'size': 'S', 'quantity': 3},
+        headers={'Authorization': f'Bearer {authorize_admin}'}
+    )
+
+    response = await async_client.get(
+        '/clothing/Shirt/sizes/', headers={**headers, 'If-None-Match': etag}
+    )
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert {'size': 'S', 'quantity': 3} in response.json()
+
+
+async def test_catalog_cache_invalidate_keeps_other_keys():
+    cache = CatalogCache(max_size=10, ttl=60)
+    cache.set(('clothing', 'page'), cache.version, b'[]')
+    cache.set(('sizes', 'Shirt'), cache.version, b'[]')
+    cache.set(('sizes', 'Coat'), cache.version, b'[]')
+    # Read before the order of a Shirt was committed, must not be cached.
+    version = cache.version
+    cache.invalidate([('sizes', 'Shirt')])
+    cache.set(('sizes', 'Shirt'), version, b'[]')
+    cache.set(('sizes', 'Hat'), version, b'[]')
+
+    assert cache.get(('clothing', 'page')) is not None
+    assert cache.get(('sizes', 'Coat')) is not None
+    assert cache.get(('sizes', 'Hat')) is not None
+    assert cache.get(('sizes', 'Shirt')) is None
+
+
+async def test_get_clothing_sizes_coalesced(async_client: AsyncClient, authorize_user):
+    headers = {'Authorization': f'Bearer {authorize_user}'}
+    coalesced = sizes_single_flight.coalesced
+    lookup_started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_sizes(db, name):
+        lookup_started.set()
+        await release.wait()
+        return [SizeResponse(size='M', quantity=10)]
+
+    with patch('src.clothing.router.get_available_sizes', side_effect=slow_sizes) as lookup:
+        requests = [
+            asyncio.create_task(async_client.get('/clothing/Shirt/sizes/', headers=headers))
+            for _ in range(20)
+        ]
+        await lookup_started.wait()
+        await asyncio.sleep(0.05)
+        release.set()
+        responses = await asyncio.gather(*requests)
+
+    assert lookup.call_count == 1
+    assert sizes_single_flight.coalesced - coalesced == 19
+    assert {response.status_code for response in responses} == {200}
+    assert {response.content for response in responses} == {b'[{"size":"M","quantity":10}]'}
+
+
+async def test_get_all_clothing_pages(async_client: AsyncClient, authorize_user, add_clothing):
+    headers = {'Authorization': f'Bearer {authorize_user}'}
+    first = await async_client.get('/clothing/?limit=1', headers=headers)
+    cursor = first.headers['X-Next-Cursor']
+    second = await async_client.get(f'/clothing/?limit=1&cursor={cursor}', headers=headers)
+
+    assert first.json() == [{'name': 'Shirt'}]
+    assert second.json() == [{'name': 'Cap'}]
+    assert 'X-Next-Cursor' not in second.headers
+
+
+@pytest.mark.query_budget(2)
+async def test_get_clothing_sizes_many(async_client: AsyncClient, authorize_user, add_clothing):
+    response = await async_client.post(
+        '/clothing/sizes/',
+        headers={'Authorization': f'Bearer {authorize_user}'},
+        json={'names': ['Shirt', 'Cap', 'Gloves']}
+    )
+
+    assert response.status_code == 200
+    assert response.json()['Cap'] == []
+    assert {'size': 'M', 'quantity': 10} in response.json()['Shirt']
+    assert 'Gloves' not in response.json()
+
+
+async def test_get_clothing_sizes_many_too_many_names(async_client: AsyncClient, authorize_user):
+    response = await async_client.post(
+        '/clothing/sizes/',
+        headers={'Authorization': f'Bearer {authorize_user}'},
+        json={'names': ['Shirt'] * 301}
+    )
+
+    assert response.status_code == 422
+
+
+async def test_access_log_uses_route_template(async_client: AsyncClient, authorize_user):
+    with patch('src.middleware.logger_request.info') as log:
+        response = await async_client.get(
+            '/clothing/Gloves/sizes/',
+            headers={'Authorization': f'Bearer {authorize_user}'}
+        )
+
+    assert response.status_code == 404
+    fields = log.call_args.kwargs['extra']['fields']
+    assert fields['method'] == 'GET'
+    assert fields['path'] == '/clothing/{name}/sizes/'
+    assert fields['status'] == 404
+
+
+async def test_metrics(async_client: AsyncClient, authorize_user):
+    await async_client.get(
+        '/clothing/Shirt/sizes/',
+        headers={'Authorization': f'Bearer {authorize_user}'}
+    )
+
+    response = await async_client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    assert '# TYPE http_requests_total counter' in lines
+    assert any(
+        line.startswith('http_requests_total{method="GET",route="/clothing/{name}/sizes/",'
+                        'status="200"} ')
+        for line in lines
+    )
+    statements = next(
+        line for line in lines
+        if line.startswith('http_request_db_statements_sum{route="/clothing/{name}/sizes/"}')
+    )
+    assert float(statements.split()[-1]) >= 1
+    assert any(line.startswith('catalog_cache_misses_total ') for line in lines)
+    assert any(line.startswith('db_pool_size{engine="primary"} ') for line in lines)
+
+
+async def test_metrics_token(async_client: AsyncClient):
+    with patch.object(settings, 'METRICS_TOKEN', 'scrape-secret'):
+        missing = await async_client.get('/metrics')
+        wrong = await async_client.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+        response = await async_client.get(
+            '/metrics', headers={'Authorization': 'Bearer scrape-secret'}
+        )
+
+    assert missing.status_code == 401
+    assert wrong.status_code == 401
+    assert wrong.json() == {'detail': 'Invalid metrics token'}
+    assert response.status_code == 200
+
+
+async def test_query_budget_lists_statements(
+        async_client: AsyncClient, authorize_user, query_budget
+):
+    with pytest.raises(pytest.fail.Exception, match='budget is 0') as error:
+        with query_budget(0):
+            await async_client.get(
+                '/clothing/Shirt/sizes/',
+                headers={'Authorization': f'Bearer {authorize_user}'}
+            )
+
+    assert 'FROM clothing LEFT OUTER JOIN sizes' in str(error.value)
+
+
+async def test_query_budget_requires_a_request(query_budget):
+    with pytest.raises(pytest.fail.Exception, match='No request was made'):
+        with query_budget(1):
+            pass
+
+
+async def test_stock_snapshot_sizes(stock_snapshot: StockSnapshot):
+    stock_snapshot.write([('Shirt', 'M', 10), ('Shirt', 'S', 0), ('Hat', None, None)])
+
+    assert stock_snapshot.sizes('Shirt') == [StockSize('M', 10)]
+    assert stock_snapshot.sizes('Hat') == []
+    assert stock_snapshot.sizes('Coat') is None
+
+
+async def test_stock_snapshot_shared_between_instances(stock_snapshot: StockSnapshot):
+    stock_snapshot.write([('Shirt', 'M', 10)])
+    reader = StockSnapshot(stock_snapshot.name, 16, stock_snapshot.lock_path, 60, 60)
+
+    assert not reader._acquire()
+    assert reader.sizes('Shirt') == [StockSize('M', 10)]
+    stock_snapshot.write([('Shirt', 'M', 9), ('Coat', 'L', 1)])
+    assert reader.sizes('Shirt') == [StockSize('M', 9)]
+    assert reader.sizes('Coat') == [StockSize('L', 1)]
+    await reader.stop()
+
+
+async def test_stock_snapshot_unavailable(stock_snapshot: StockSnapshot):
+    with pytest.raises(SnapshotUnavailable):
+        stock_snapshot.sizes('Shirt')
+
+    stock_snapshot.write([('Shirt', 'M', 10)])
+    sequence, *header = HEADER.unpack_from(stock_snapshot._shm.buf)
+    HEADER.pack_into(stock_snapshot._shm.buf, 0, sequence + 1, *header)
+    with pytest.raises(SnapshotUnavailable):
+        stock_snapshot.sizes('Shirt')
+    assert stock_snapshot.torn_reads == 8
+
+    stock_snapshot.write([('Shirt', 'M', 10)])
+    stock_snapshot.max_age = 0.01
+    time.sleep(0.02)
+    with pytest.raises(SnapshotUnavailable):
+        stock_snapshot.sizes('Shirt')
+
+
+async def test_get_clothing_sizes_from_snapshot(
+        async_client: AsyncClient, authorize_user, stock_snapshot: StockSnapshot, query_budget
+):
+    headers = {'Authorization': f'Bearer {authorize_user}'}
+    stock_snapshot.write([('Shirt', 'M', 7), ('Hat', None, None)])
+
+    with patch.object(settings, 'STOCK_SNAPSHOT_ENABLED', True), \
+            patch('src.clothing.router.stock_snapshot', stock_snapshot):
+        with query_budget(1):
+            response = await async_client.get('/clothing/Shirt/sizes/', headers=headers)
+            no_sizes = await async_client.get('/clothing/Hat/sizes/', headers=headers)
+            not_found = await async_client.get('/clothing/Coat/sizes/', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json() == [{'size': 'M', 'quantity': 7}]
+    assert no_sizes.status_code == 409
+    assert not_found.status_code == 404
+    assert catalog_cache.get(('sizes', 'Shirt')) is None
+
+
+async def test_stock_subscription_coalesces_changes():
+    subscription = Subscription(frozenset({'Shirt', 'Hat'}), max_pending=2)
+    subscription.push(StockChange('Shirt', 'M', 9))
+    subscription.push(StockChange('Coat', 'M', 1))
+    subscription.push(StockChange('Hat', 'S', 2))
+    subscription.push(StockChange('Shirt', 'M', 8))
+
+    assert await subscription.next(1) == [StockChange('Hat', 'S', 2), StockChange('Shirt', 'M', 8)]
+    assert await subscription.next(0.01) == []
+
+    subscription.push(StockChange('Shirt', 'M', 7))
+    subscription.push(StockChange('Shirt'))
+    assert await subscription.next(1) == [StockChange('Shirt')]
+
+    for size in ('S', 'M', 'L'):
+        subscription.push(StockChange('Shirt', size, 1))
+    with pytest.raises(SubscriptionOverflow):
+        await subscription.next(1)
+
+
+async def test_stock_event_stream_format():
+    subscription = Subscription(None, max_pending=10)
+    stream = _stock_event_stream(subscription)
+    assert await anext(stream) == b'retry: 3000\n\n'
+
+    subscription.push(StockChange('Shirt', 'M', 9))
+    subscription.push(StockChange('Hat'))
+    assert await anext(stream) == (
+        b'event: stock\ndata: {"name":"Shirt","size":"M","quantity":9}\n\n'
+    )
+    assert await anext(stream) == b'event: deleted\ndata: {"name":"Hat"}\n\n'
+
+    with patch.object(settings, 'STOCK_EVENTS_HEARTBEAT_SECONDS', 0.01):
+        assert await anext(stream) == b': ping\n\n'
+
+    subscription.overflow()
+    assert await anext(stream) == b'event: reset\ndata: {}\n\n'
+    with pytest.raises(StopAsyncIteration):
+        await anext(stream)
+
+
+async def test_stock_events_delivered_after_commit(session_factory: async_sessionmaker):
+    events = StockEvents(settings.STOCK_EVENTS_CHANNEL, 10, 1000, reconnect_interval=0.1)
+    events.start(settings.async_database_url_test.replace('+asyncpg', ''))
+    try:
+        while not events.connected:
+            await asyncio.sleep(0.01)
+        with events.subscribe() as subscription, \
+                patch.object(settings, 'STOCK_EVENTS_ENABLED', True):
+            version = catalog_cache.version
+            async with session_factory() as session:
+                await publish_stock_changes(session, [StockChange('Ghost', 'M', 1)])
+                await session.rollback()
+            async with session_factory() as session:
+                await publish_stock_changes(
+                    session, [StockChange(f'Coat{number}', 'M', number) for number in range(300)]
+                )
+                await session.commit()
+            changes = []
+            while len(changes) < 300:
+                changes += await subscription.next(1)
+    finally:
+        await events.stop()
+
+    assert changes == [StockChange(f'Coat{number}', 'M', number) for number in range(300)]
+    assert catalog_cache.version > version
+    assert events.received == 300
+
+
+async def test_get_stock_events_disabled(async_client: AsyncClient, authorize_user):
+    response = await async_client.get(
+        '/clothing/stock/events/', headers={'Authorization': f'Bearer {authorize_user}'}
+    )
+
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'Stock events are disabled'}
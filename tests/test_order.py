@@ -1,6 +1,22 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
 from httpx import AsyncClient
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.auth.models import User
+from src.clothing.models import Clothing, Size
+from src.clothing.snapshot import StockSnapshot
+from src.config import settings
+from src.idempotency.cache import idempotency_cache
+from src.idempotency.dependencies import IdempotentRequest, delete_expired_keys
+from src.order.dependencies import reserve_cart
+from src.order.models import Order
 
 
+@pytest.mark.query_budget(2)
 async def test_create_order_success(async_client: AsyncClient, authorize_user):
     order_data = {"name": "Shirt", "size": "M"}
     response = await async_client.post(
@@ -13,6 +29,7 @@ async def test_create_order_success(async_client: AsyncClient, authorize_user):
     assert response.json() == order_data
 
 
+@pytest.mark.query_budget(3)
 async def test_create_order_clothing_not_found(async_client: AsyncClient, authorize_user):
     order_data = {"name": "Boots", "size": "M"}
     response = await async_client.post(
@@ -53,3 +70,288 @@ async def test_create_order_already_ordered(async_client: AsyncClient, authorize
 
     assert response.status_code == 409
     assert response.json() == {"detail": "You have already ordered Shirt"}
+
+
+async def test_create_order_concurrent_never_oversells(
+        async_client: AsyncClient, concurrent_buyers
+):
+    connections = asyncio.Semaphore(50)
+
+    async def order(token):
+        async with connections:
+            return await async_client.post(
+                "/orders/",
+                headers={"Authorization": f"Bearer {token}"},
+                json={"name": "Jacket", "size": "L"}
+            )
+
+    responses = await asyncio.gather(*(order(token) for token in concurrent_buyers))
+    status_codes = [response.status_code for response in responses]
+
+    assert status_codes.count(200) == 25
+    assert status_codes.count(404) == len(concurrent_buyers) - 25
+
+
+async def test_create_order_concurrent_one_per_clothing(
+        async_client: AsyncClient, concurrent_buyers, session_factory: async_sessionmaker
+):
+    async with session_factory() as db:
+        scarf = Clothing(name="Scarf")
+        db.add(scarf)
+        await db.flush()
+        db.add_all([Size(clothing_id=scarf.id, size=size, quantity=10) for size in "SML"])
+        await db.commit()
+    headers = {"Authorization": f"Bearer {concurrent_buyers[-4]}"}
+
+    responses = await asyncio.gather(*(
+        async_client.post("/orders/", headers=headers, json={"name": "Scarf", "size": size})
+        for size in "SML" * 10
+    ))
+    status_codes = [response.status_code for response in responses]
+
+    assert status_codes.count(200) == 1
+    assert status_codes.count(409) == 29
+    async with session_factory() as db:
+        orders = await db.execute(
+            select(Order.id).join(Size).filter(Size.clothing_id == scarf.id)
+        )
+        assert len(orders.all()) == 1
+
+
+@pytest.mark.query_budget(3)
+async def test_create_cart_order(async_client: AsyncClient, authorize_user, cart_stock):
+    response = await async_client.post(
+        "/orders/cart/",
+        headers={"Authorization": f"Bearer {authorize_user}"},
+        json={"items": [{"name": "Mittens", "size": "s"}, {"name": "Hoodie", "size": "L"}]}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"line": 1, "name": "Mittens", "size": "S", "status": "ordered", "detail": None},
+        {"line": 2, "name": "Hoodie", "size": "L", "status": "ordered", "detail": None},
+    ]
+
+
+async def test_create_cart_order_all_or_nothing(
+        async_client: AsyncClient, authorize_user, cart_stock
+):
+    headers = {"Authorization": f"Bearer {authorize_user}"}
+    response = await async_client.post(
+        "/orders/cart/",
+        headers=headers,
+        json={"items": [
+            {"name": "Beanie", "size": "S"},
+            {"name": "Mittens", "size": "M"},
+            {"name": "Parka", "size": "S"},
+            {"name": "Hoodie", "size": "L"},
+            {"name": "Beanie", "size": "S"},
+        ]}
+    )
+
+    assert response.status_code == 409
+    assert response.json() == {"detail": [
+        {"line": 2, "name": "Mittens", "size": "M", "status": "error",
+         "detail": "The Mittens size M are out of stock"},
+        {"line": 3, "name": "Parka", "size": "S", "status": "error",
+         "detail": "Clothing with name Parka not found"},
+        {"line": 4, "name": "Hoodie", "size": "L", "status": "error",
+         "detail": "You have already ordered Hoodie"},
+        {"line": 5, "name": "Beanie", "size": "S", "status": "error",
+         "detail": "You have already ordered Beanie"},
+    ]}
+    sizes = await async_client.get("/clothing/Beanie/sizes/", headers=headers)
+    assert sizes.json() == [{"size": "S", "quantity": 1}]
+
+
+async def test_create_cart_order_concurrent_never_deadlocks(
+        async_client: AsyncClient, concurrent_buyers, cart_stock
+):
+    connections = asyncio.Semaphore(50)
+
+    async def order(number, token):
+        items = [{"name": "Poncho", "size": "XL"}, {"name": "Vest", "size": "XL"}]
+        async with connections:
+            return await async_client.post(
+                "/orders/cart/",
+                headers={"Authorization": f"Bearer {token}"},
+                json={"items": items[::-1] if number % 2 else items}
+            )
+
+    responses = await asyncio.gather(
+        *(order(number, token) for number, token in enumerate(concurrent_buyers[:60]))
+    )
+    status_codes = [response.status_code for response in responses]
+
+    assert status_codes.count(200) == 30
+    assert status_codes.count(409) == 30
+
+
+async def test_create_order_idempotency_key(
+        async_client: AsyncClient, authorize_user, cart_stock, query_budget
+):
+    headers = {"Authorization": f"Bearer {authorize_user}", "Idempotency-Key": "order-1"}
+    response = await async_client.post(
+        "/orders/", headers=headers, json={"name": "Beanie", "size": "S"}
+    )
+
+    assert response.status_code == 200
+    with query_budget(1):
+        retry = await async_client.post(
+            "/orders/", headers=headers, json={"name": "Beanie", "size": "S"}
+        )
+    assert retry.status_code == 200
+    assert retry.content == response.content
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    idempotency_cache.clear()
+    with query_budget(2):
+        retry = await async_client.post(
+            "/orders/", headers=headers, json={"name": "Beanie", "size": "S"}
+        )
+    assert retry.status_code == 200
+    assert retry.content == response.content
+
+    other = await async_client.post(
+        "/orders/", headers=headers, json={"name": "Hoodie", "size": "L"}
+    )
+    assert other.status_code == 422
+    assert other.json() == {"detail": "Idempotency-Key was already used for another request"}
+    sizes = await async_client.get("/clothing/Beanie/sizes/", headers=headers)
+    assert sizes.status_code == 409
+
+
+async def test_idempotency_key_lost_to_unfinished_request(
+        async_client: AsyncClient, cart_stock, concurrent_buyers
+):
+    headers = {"Authorization": f"Bearer {concurrent_buyers[-1]}", "Idempotency-Key": "lost"}
+    before = await async_client.get("/clothing/Hoodie/sizes/", headers=headers)
+    # Another request saved the key, but there is no response of it to replay.
+    with patch.object(IdempotentRequest, "save", return_value=False):
+        response = await async_client.post(
+            "/orders/", headers=headers, json={"name": "Hoodie", "size": "L"}
+        )
+
+    assert response.status_code == 409
+    assert response.json() == {"detail": "A request with this Idempotency-Key is in progress"}
+    after = await async_client.get("/clothing/Hoodie/sizes/", headers=headers)
+    assert after.json() == before.json()
+
+
+async def test_expired_idempotency_keys_deleted(session_factory: async_sessionmaker):
+    async with session_factory() as db:
+        assert await delete_expired_keys(db, 100) == 0
+        with patch.object(settings, "IDEMPOTENCY_KEY_TTL_SECONDS", 0):
+            assert await delete_expired_keys(db, 1) == 1
+            assert await delete_expired_keys(db, 100) >= 1
+        await db.rollback()
+
+
+async def test_too_many_statements_logged(async_client: AsyncClient, authorize_user):
+    with patch('src.middleware.settings.DB_STATEMENTS_WARN_PER_REQUEST', 1), \
+            patch('src.middleware.logger_request.warning') as warning:
+        await async_client.post(
+            '/orders/',
+            headers={'Authorization': f'Bearer {authorize_user}'},
+            json={'name': 'Boots', 'size': 'M'}
+        )
+
+    fields = warning.call_args.kwargs['extra']['fields']
+    assert fields['path'] == '/orders/'
+    assert fields['statements'] >= 2
+
+
+@pytest.mark.query_budget(2)
+async def test_create_order_rejected_by_snapshot(
+        async_client: AsyncClient, authorize_user, stock_snapshot: StockSnapshot
+):
+    stock_snapshot.write([("Shirt", "M", 5)])
+
+    with patch.object(settings, "STOCK_SNAPSHOT_ENABLED", True), \
+            patch("src.order.router.stock_snapshot", stock_snapshot):
+        out_of_stock = await async_client.post(
+            "/orders/",
+            headers={"Authorization": f"Bearer {authorize_user}"},
+            json={"name": "Shirt", "size": "XL"}
+        )
+        not_found = await async_client.post(
+            "/orders/",
+            headers={"Authorization": f"Bearer {authorize_user}"},
+            json={"name": "Boots", "size": "M"}
+        )
+
+    assert out_of_stock.status_code == 404
+    assert out_of_stock.json() == {"detail": "The Shirt size XL are out of stock"}
+    assert not_found.status_code == 404
+    assert not_found.json() == {"detail": "Clothing with name Boots not found"}
+
+
+async def test_create_order_not_rejected_by_stale_snapshot(
+        async_client: AsyncClient, cart_stock, concurrent_buyers, stock_snapshot: StockSnapshot
+):
+    # The snapshot has not seen the Hoodie L restock yet, the database still decides.
+    stock_snapshot.write([("Hoodie", "M", 5)])
+
+    with patch.object(settings, "STOCK_SNAPSHOT_ENABLED", True), \
+            patch("src.order.router.stock_snapshot", stock_snapshot):
+        response = await async_client.post(
+            "/orders/",
+            headers={"Authorization": f"Bearer {concurrent_buyers[-2]}"},
+            json={"name": "Hoodie", "size": "L"}
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {"name": "Hoodie", "size": "L"}
+
+
+async def test_create_cart_order_lost_after_lock(
+        async_client: AsyncClient, cart_stock, concurrent_buyers
+):
+    headers = {"Authorization": f"Bearer {concurrent_buyers[-3]}"}
+    before = await async_client.get("/clothing/Mittens/sizes/", headers=headers)
+
+    async def ordered_meanwhile(db, email, size_ids):
+        # An order of the Hoodie by the same user lands between the lock and the reservation.
+        hoodie = select(Size.id).join(Clothing).filter(Clothing.name == "Hoodie")
+        await db.execute(insert(Order).from_select(
+            ["user_id", "size_id"],
+            select(User.id, hoodie.scalar_subquery()).filter(User.email == email)
+        ))
+        return await reserve_cart(db, email, size_ids)
+
+    with patch("src.order.router.reserve_cart", ordered_meanwhile):
+        response = await async_client.post(
+            "/orders/cart/",
+            headers=headers,
+            json={"items": [{"name": "Hoodie", "size": "L"}, {"name": "Mittens", "size": "S"}]}
+        )
+
+    assert response.status_code == 409
+    assert response.json() == {"detail": [
+        {"line": 1, "name": "Hoodie", "size": "L", "status": "error",
+         "detail": "The Hoodie size L can not be ordered"},
+    ]}
+    after = await async_client.get("/clothing/Mittens/sizes/", headers=headers)
+    assert after.json() == before.json()
+
+
+async def test_deleting_user_keeps_orders(
+        async_client: AsyncClient, authorize_admin, concurrent_buyers,
+        session_factory: async_sessionmaker
+):
+    async with session_factory() as db:
+        email, order_id = (await db.execute(
+            select(User.email, Order.id).join(Order, Order.user_id == User.id).filter(
+                User.email.like("buyer%")
+            ).limit(1)
+        )).one()
+
+    response = await async_client.delete(
+        f"/admin/users/?email={email}", headers={"Authorization": f"Bearer {authorize_admin}"}
+    )
+
+    assert response.status_code == 200
+    async with session_factory() as db:
+        order = await db.get(Order, order_id)
+        assert order.user_id is None
+        assert order.size_id is not None